@@ -1,5 +1,6 @@
 import json
 import os
+import re
 import logging
 from typing import Any, Dict, List, Optional, Union
 from agency_swarm.tools import BaseTool  # type: ignore
@@ -27,6 +28,8 @@ def setup_logger(name: str) -> logging.Logger:
 logger = setup_logger(__name__)
 load_dotenv()
 
+_PRICE_RE = re.compile(r"[-+]?[0-9]*\.?[0-9]+")
+
 
 class ProductDataRetriever(BaseTool):
     """
@@ -735,16 +738,14 @@ Consider aspirational language, lifestyle cues, and identity-building desires. E
                         value = product.get(key)
                         if value is None:
                             continue
-                        # Numeric already
-                        if isinstance(value, (int, float)):
-                            try:
-                                return round(float(value), 2)
-                            except Exception:
-                                continue
-                        # String: extract first number
+                        # Numeric already (ints are widened without a redundant float() of a float)
+                        if isinstance(value, float):
+                            return round(value, 2)
+                        if isinstance(value, int):
+                            return float(value)
+                        # String: extract first number, stripping thousands separators only when present
                         if isinstance(value, str):
-                            import re
-                            m = re.search(r"[-+]?[0-9]*\.?[0-9]+", value.replace(",", ""))
+                            m = _PRICE_RE.search(value.replace(",", "") if "," in value else value)
                             if m:
                                 try:
                                     return round(float(m.group(0)), 2)
@@ -752,11 +753,10 @@ Consider aspirational language, lifestyle cues, and identity-building desires. E
                                     pass
                 return None
 
-            minimal_products: List[Dict[str, Any]] = []
-            for p in matching_products:
+            def _build_minimal(p: Dict[str, Any]) -> Optional[Dict[str, Any]]:
                 sku_value = _extract_sku(p)
                 if not sku_value:
-                    continue  # Skip items without a resolvable SKU
+                    return None  # Skip items without a resolvable SKU
                 minimal_entry: Dict[str, Any] = {
                     "title": _extract_title(p),
                     "sku": sku_value,
@@ -767,7 +767,11 @@ Consider aspirational language, lifestyle cues, and identity-building desires. E
                 price = _extract_price(p)
                 if price is not None:
                     minimal_entry["price"] = price
-                minimal_products.append(minimal_entry)
+                return minimal_entry
+
+            minimal_products: List[Dict[str, Any]] = [
+                e for e in (_build_minimal(p) for p in matching_products) if e is not None
+            ]
 
             result = {
                 "success": True,
@@ -1,5 +1,7 @@
 import os
+import re
 import json
+import uuid
 import logging
 from typing import List, Dict, Any, Optional
 from pathlib import Path
@@ -9,6 +11,12 @@ from agency_swarm.tools import BaseTool
 from pydantic import Field
 from dotenv import load_dotenv
 
+# Optional dependencies
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
 
 def setup_logger(name: str) -> logging.Logger:
     """Create a simple console logger if not already configured."""
@@ -28,6 +36,9 @@ def setup_logger(name: str) -> logging.Logger:
 logger = setup_logger(__name__)
 load_dotenv()
 
+_PRICE_RE = re.compile(r"[-+]?[0-9]*\.?[0-9]+")
+_EXCEL_ERROR_VALUES = frozenset({"#REF!", "#N/A", "#VALUE!", "#ERROR!", ""})
+
 
 class ProfitCalculatorTool(BaseTool):
     """
@@ -48,6 +59,8 @@ class ProfitCalculatorTool(BaseTool):
 
     def __init__(self, **data):
         super().__init__(**data)
+        # Formatted once per instance; reused by every per-SKU calculation and the summary
+        self._conv_rate_str = f"{self.conversion_rate*100:.1f}%"
 
     def _validate_tool_inputs(self) -> bool:
         """Validate the tool input parameters."""
@@ -93,20 +106,18 @@ class ProfitCalculatorTool(BaseTool):
                 if value:
                     session_id = str(value)[:8]  # Use first 8 characters
                     if self.debug:
-                        logger.info(f"🔍 Found session ID from header {header}: {session_id}")
+                        logger.info("🔍 Found session ID from header %s: %s", header, session_id)
                     return session_id
             
             # Fallback: generate new UUID for local development
-            import uuid
             new_session_id = str(uuid.uuid4())[:8]
             if self.debug:
-                logger.info(f"🆔 Generated new session ID: {new_session_id}")
+                logger.info("🆔 Generated new session ID: %s", new_session_id)
             return new_session_id
             
         except Exception as e:
             if self.debug:
-                logger.warning(f"Error getting session ID: {e}")
-            import uuid
+                logger.warning("Error getting session ID: %s", e)
             return str(uuid.uuid4())[:8]
 
     def _get_follower_count_from_cache(self) -> int:
@@ -118,7 +129,7 @@ class ProfitCalculatorTool(BaseTool):
             
             if not analysis_dir.exists():
                 if self.debug:
-                    logger.warning(f"Analysis directory not found: {analysis_dir}")
+                    logger.warning("Analysis directory not found: %s", analysis_dir)
                 return 0
             
             # Find the latest analysis file for this session
@@ -127,13 +138,13 @@ class ProfitCalculatorTool(BaseTool):
             
             if not files:
                 if self.debug:
-                    logger.warning(f"No analysis files found for session: {session_id}")
+                    logger.warning("No analysis files found for session: %s", session_id)
                 return 0
             
             # Get the most recent file
             latest_file = max(files, key=lambda f: f.stat().st_mtime)
             if self.debug:
-                logger.info(f"Loading follower data from: {latest_file}")
+                logger.info("Loading follower data from: %s", latest_file)
             
             with open(latest_file, 'r') as f:
                 data = json.load(f)
@@ -149,13 +160,13 @@ class ProfitCalculatorTool(BaseTool):
             )
             
             if self.debug:
-                logger.info(f"Found follower count: {follower_count}")
+                logger.info("Found follower count: %s", follower_count)
             
             return int(follower_count)
                 
         except Exception as e:
             if self.debug:
-                logger.warning(f"Failed to get follower count from cache: {e}")
+                logger.warning("Failed to get follower count from cache: %s", e)
             return 0
 
     def _get_nocodb_credentials(self):
@@ -197,48 +208,75 @@ class ProfitCalculatorTool(BaseTool):
             "accept": "application/json",
         }
 
-        # Fetch all products and filter by SKUs (NocoDB filtering can be tricky with OR conditions)
+        # Push the SKU filter to NocoDB so only matching rows cross the wire.
+        # SKUs containing filter syntax characters cannot be expressed safely, so those
+        # requests go straight to the full-table fallback.
+        wanted = {str(sku) for sku in skus}
+        if wanted and not any(("," in sku or "(" in sku or ")" in sku) for sku in wanted):
+            params = {
+                "where": "(SKU,in," + ",".join(sorted(wanted)) + ")",
+                "limit": len(wanted) * 2,
+                "offset": 0,
+            }
+            try:
+                matching_products = self._match_products_by_sku(self._get_records(url, headers, params), wanted)
+            except RuntimeError as e:
+                # Tables whose SKU column isn't named "SKU" reject the where clause
+                if self.debug:
+                    logger.warning("Server-side SKU filter failed, falling back to full fetch: %s", e)
+            else:
+                # The filter ran, so an empty result means no product has these SKUs
+                if self.debug:
+                    logger.info("Found %s products matching SKUs: %s", len(matching_products), skus)
+                return matching_products
+
+        # Fallback: fetch all products and filter by SKU variants in Python
         params = {
             "limit": 1000,
             "offset": 0,
         }
+        matching_products = self._match_products_by_sku(self._get_records(url, headers, params), wanted)
+
+        if self.debug:
+            logger.info("Found %s products matching SKUs: %s", len(matching_products), skus)
+
+        return matching_products
 
+    def _get_records(self, url: str, headers: Dict[str, str], params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """GET a page of NocoDB records and return its row list."""
         try:
             response = requests.get(url, headers=headers, params=params, timeout=30)
             response.raise_for_status()
             
-            result = response.json()
-            all_products = result.get("list", [])
-            
-            # Filter products by SKU
-            matching_products = []
-            for product in all_products:
-                # Check various possible SKU field names
-                sku_candidates = [
-                    "SKU", "sku", "Sku", "product_sku", "Product SKU", "productSKU",
-                    "code", "Code", "CODE"
-                ]
-                product_sku = None
-                for sku_key in sku_candidates:
-                    if sku_key in product and product.get(sku_key):
-                        product_sku = str(product.get(sku_key))
-                        break
-                
-                if product_sku and product_sku in skus:
-                    matching_products.append(product)
-            
-            if self.debug:
-                logger.info(f"Found {len(matching_products)} products matching SKUs: {skus}")
-            
-            return matching_products
+            result = orjson.loads(response.content) if orjson else response.json()
+            return result.get("list", [])
 
         except requests.HTTPError as exc:
             try:
-                err_payload = response.json()
+                err_payload = orjson.loads(response.content) if orjson else response.json()
             except Exception:
                 err_payload = {"message": response.text}
             raise RuntimeError(f"NocoDB fetch failed: {response.status_code} {err_payload}") from exc
 
+    def _match_products_by_sku(self, products: List[Dict[str, Any]], skus: set) -> List[Dict[str, Any]]:
+        """Keep only products whose SKU (under any known field name) is in the requested set."""
+        # Check various possible SKU field names
+        sku_candidates = [
+            "SKU", "sku", "Sku", "product_sku", "Product SKU", "productSKU",
+            "code", "Code", "CODE"
+        ]
+        matching_products = []
+        for product in products:
+            product_sku = None
+            for sku_key in sku_candidates:
+                if sku_key in product and product.get(sku_key):
+                    product_sku = str(product.get(sku_key))
+                    break
+            
+            if product_sku and product_sku in skus:
+                matching_products.append(product)
+        return matching_products
+
     def _extract_price_from_field(self, product: Dict[str, Any], field_candidates: List[str]) -> Optional[float]:
         """Extract price from product data using field candidates."""
         for key in field_candidates:
@@ -247,23 +285,21 @@ class ProfitCalculatorTool(BaseTool):
                 if value is None:
                     continue
                 
-                # Numeric already
-                if isinstance(value, (int, float)):
-                    try:
-                        return round(float(value), 2)
-                    except Exception:
-                        continue
+                # Numeric already (ints are widened without a redundant float() of a float)
+                if isinstance(value, float):
+                    return round(value, 2)
+                if isinstance(value, int):
+                    return float(value)
                 
                 # String: handle special cases and extract price
                 if isinstance(value, str):
                     # Skip Excel error values
-                    if value.strip() in ["#REF!", "#N/A", "#VALUE!", "#ERROR!", ""]:
+                    if value.strip() in _EXCEL_ERROR_VALUES:
                         continue
                     
-                    import re
-                    # Remove dollar signs and other currency symbols, then extract number
-                    cleaned_value = value.replace("$", "").replace(",", "").strip()
-                    m = re.search(r"[-+]?[0-9]*\.?[0-9]+", cleaned_value)
+                    # Remove dollar signs and thousands separators only when present, then extract number
+                    cleaned_value = value.replace("$", "").replace(",", "") if ("$" in value or "," in value) else value
+                    m = _PRICE_RE.search(cleaned_value)
                     if m:
                         try:
                             return round(float(m.group(0)), 2)
@@ -287,11 +323,6 @@ class ProfitCalculatorTool(BaseTool):
         price = self._extract_price_from_field(product, base_cost_candidates)
         return price
 
-    def _extract_membership_prices(self, product: Dict[str, Any]) -> Dict[str, Optional[float]]:
-        """Backward-compat: not used in MVP; returns only a 'Base (Non-Member)' mapping if available."""
-        base_cost = self._extract_base_cost(product)
-        return {"Base (Non-Member)": base_cost}
-
     def _extract_product_info(self, product: Dict[str, Any]) -> Dict[str, Any]:
         """Extract key product information."""
         # Extract title/name
@@ -323,20 +354,20 @@ class ProfitCalculatorTool(BaseTool):
         # Extract category
         category = product.get("Category") or product.get("category") or "Unknown"
         
-        # Extract base cost from NocoDB (non-membership)
-        membership_prices = self._extract_membership_prices(product)
-        
         return {
             "name": product_name,
             "sku": product_sku,
             "category": str(category),
-            "membership_prices": membership_prices
+            # Base cost from NocoDB (non-membership)
+            "base_cost": self._extract_base_cost(product)
         }
 
-    def _calculate_profit_simple(self, base_cost: float, retail_price: float, followers: int, conversion_rate: float) -> Dict[str, Any]:
-        """Simple MVP profit calc: unit profit and earnings estimate."""
+    def _calculate_profit_simple(self, base_cost: float, retail_price: float, followers: int, estimated_buyers: int, conversion_rate_str: str) -> Dict[str, Any]:
+        """Simple MVP profit calc: unit profit and earnings estimate.
+
+        estimated_buyers and conversion_rate_str are run-wide invariants computed once by the caller.
+        """
         profit_per_unit = max(0.0, retail_price - base_cost)
-        estimated_buyers = int(max(0, followers) * conversion_rate)
         estimated_earnings = round(profit_per_unit * estimated_buyers, 2)
         margin_pct = f"{(profit_per_unit / retail_price * 100):.1f}%" if retail_price > 0 else "0%"
         return {
@@ -345,7 +376,7 @@ class ProfitCalculatorTool(BaseTool):
             "profit_per_unit": round(profit_per_unit, 2),
             "margin": margin_pct,
             "followers": followers,
-            "conversion_rate": f"{conversion_rate*100:.1f}%",
+            "conversion_rate": conversion_rate_str,
             "estimated_buyers": estimated_buyers,
             "estimated_earnings": estimated_earnings,
         }
@@ -362,7 +393,7 @@ class ProfitCalculatorTool(BaseTool):
             
             if self.debug:
                 mode = "check_price_only" if self.check_price_only else "mvp_simple"
-                logger.info(f"Calculating ({mode}) for SKUs: {self.skus}")
+                logger.info("Calculating (%s) for SKUs: %s", mode, self.skus)
 
             # If only checking prices, skip follower/retail validations in runtime and return prices
             if self.check_price_only:
@@ -377,7 +408,7 @@ class ProfitCalculatorTool(BaseTool):
                 product_prices = []
                 for product in products:
                     info = self._extract_product_info(product)
-                    base_cost = info["membership_prices"].get("Base (Non-Member)")
+                    base_cost = info["base_cost"]
                     product_prices.append({
                         "product": {
                             "name": info["name"],
@@ -422,20 +453,23 @@ class ProfitCalculatorTool(BaseTool):
             # Calculate MVP profit for each product
             product_calculations = []
             total_estimated_earnings = 0.0
+            # Followers and conversion rate are constant across SKUs; compute once per run
+            estimated_buyers = int(max(0, followers) * self.conversion_rate)
             
             for product in products:
                 product_info = self._extract_product_info(product)
-                base_cost = product_info["membership_prices"].get("Base (Non-Member)")
+                base_cost = product_info["base_cost"]
                 if base_cost is None:
                     if self.debug:
-                        logger.warning(f"No base (non-member) cost found for product {product_info.get('sku')}, skipping")
+                        logger.warning("No base (non-member) cost found for product %s, skipping", product_info.get('sku'))
                     continue
                     
                 simple_calc = self._calculate_profit_simple(
                     base_cost=base_cost,
                     retail_price=self.retail_price,
                     followers=followers,
-                    conversion_rate=self.conversion_rate,
+                    estimated_buyers=estimated_buyers,
+                    conversion_rate_str=self._conv_rate_str,
                 )
                 total_estimated_earnings += simple_calc["estimated_earnings"]
                 
@@ -454,7 +488,7 @@ class ProfitCalculatorTool(BaseTool):
             calculation_parameters = {
                 "mode": "mvp_simple",
                 "retail_price": self.retail_price,
-                "conversion_rate": f"{self.conversion_rate*100:.1f}%",
+                "conversion_rate": self._conv_rate_str,
                 "followers": followers
             }
             
@@ -471,7 +505,7 @@ class ProfitCalculatorTool(BaseTool):
             }
             
             if self.debug:
-                logger.info(f"Successfully calculated MVP profit for {len(product_calculations)} products")
+                logger.info("Successfully calculated MVP profit for %s products", len(product_calculations))
             
             return json.dumps(result, ensure_ascii=False, indent=2)
 
@@ -482,7 +516,7 @@ class ProfitCalculatorTool(BaseTool):
                 "message": "Failed to calculate profit",
                 "products": []
             }
-            logger.error(f"Error in ProfitCalculatorTool: {e}")
+            logger.error("Error in ProfitCalculatorTool: %s", e)
             return json.dumps(error_result, ensure_ascii=False, indent=2)
 
 
@@ -1,6 +1,11 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
+import hashlib
+import time
+import random
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 
 import requests
 from agency_swarm.tools import BaseTool
@@ -12,6 +17,147 @@ try:
     from wizard_designer.utils.highlevel_client import ensure_contact  # type: ignore
 except Exception:  # pragma: no cover
     ensure_contact = None  # type: ignore
+try:
+    from wizard_designer.utils.highlevel_client import _resolve_field_ids  # type: ignore
+except Exception:  # pragma: no cover
+    _resolve_field_ids = None  # type: ignore
+
+load_dotenv()
+
+# Optional dependencies
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+# Shared keep-alive session: discovery, update and fetch all hit the same HighLevel host.
+# Built on first use so registering the tool doesn't pay for it at agent startup.
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+_BASE_HEADERS = {"Accept": "application/json", "Content-Type": "application/json", "Version": "2021-07-28"}
+
+# Static request templates; only the per-tenant bits are filled in per call
+_FIELD_CREATE_PAYLOAD = {"name": "Product SKUs", "dataType": "TEXT"}
+_SELECTED_TAGS = ("aaas", "selected-products")
+# Upper bound for the joined SKU custom-field value
+_MAX_SKU_VALUE_LEN = 8192
+# Contact keys callers actually read from the verify fetch
+_VERIFY_CONTACT_KEYS = ("id", "email", "tags", "customFields")
+
+
+def _json_body(resp: requests.Response) -> Any:
+    """Decode a response body, preferring orjson when installed."""
+    return orjson.loads(resp.content) if orjson else resp.json()
+
+
+def _get_session() -> requests.Session:
+    """Return the shared HighLevel session, creating it on first call."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0))
+                session.headers.update(_BASE_HEADERS)
+                _SESSION = session
+    return _SESSION
+
+
+_EXECUTOR: Optional[Any] = None
+
+
+def _get_executor() -> Any:
+    """Return the shared worker pool used to overlap independent HighLevel calls."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _SESSION_LOCK:
+            if _EXECUTOR is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="save-products")
+    return _EXECUTOR
+
+
+def _auth_headers(token: str, location_id: Optional[str] = None) -> Dict[str, str]:
+    """Per-tenant headers layered on top of the session's _BASE_HEADERS."""
+    h = {"Authorization": f"Bearer {token}"}
+    if location_id:
+        h["LocationId"] = location_id
+    return h
+
+
+_RETRY_STATUSES = (429, 502, 503, 504)
+_BACKOFF_CAP_S = 30.0
+
+
+def _request_with_backoff(method: str, url: str, *, max_attempts: int = 4, base: float = 0.5, **kw: Any) -> requests.Response:
+    """Issue a request on the shared session, retrying 429/5xx and connection errors.
+
+    Waits use full jitter (uniform in [0, min(cap, base * 2**attempt)]) unless the server
+    sends a numeric Retry-After, which is honored (also capped).
+    """
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        try:
+            resp = _get_session().request(method, url, **kw)
+        except (requests.ConnectionError, requests.Timeout):
+            if last_attempt:
+                raise
+            time.sleep(random.uniform(0, min(_BACKOFF_CAP_S, base * (2 ** attempt))))
+            continue
+        if resp.status_code not in _RETRY_STATUSES or last_attempt:
+            return resp
+        retry_after = resp.headers.get("Retry-After", "")
+        try:
+            # Clamp: time.sleep rejects a negative Retry-After
+            delay = min(_BACKOFF_CAP_S, max(0.0, float(retry_after)))
+        except ValueError:
+            delay = random.uniform(0, min(_BACKOFF_CAP_S, base * (2 ** attempt)))
+        time.sleep(delay)
+    return resp
+
+
+# Process-wide memo of resolved Product SKUs field IDs, keyed by (location_id, token hash)
+_FIELD_ID_CACHE: Dict[Tuple[str, str], str] = {}
+_FIELD_ID_LOCK = threading.Lock()
+
+
+def _field_cache_key(token: str, location_id: str) -> Tuple[str, str]:
+    # Short token hash keeps different tokens apart without holding the token in the key
+    return (location_id, hashlib.sha256(token.encode("utf-8")).hexdigest()[:12])
+
+
+def _forget_field_id(token: str, location_id: str) -> None:
+    """Drop a memoized field id the API rejected so the next run resolves it again."""
+    with _FIELD_ID_LOCK:
+        field_id = _FIELD_ID_CACHE.pop(_field_cache_key(token, location_id), None)
+    # Re-reading the same id from the env would bring the stale value straight back
+    if field_id and os.environ.get("HL_CF_PRODUCT_SKUS") == field_id:
+        os.environ.pop("HL_CF_PRODUCT_SKUS", None)
+
+# Last saved SKU value per "<location>:<contact/email/session>" key -> (sku_value, contact_id).
+# LRU-bounded and guarded by _FIELD_ID_LOCK; each save records up to two keys.
+_LAST_SAVED: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_LAST_SAVED_MAX = 1024
+
+
+def _get_last_saved(key: str) -> Optional[Tuple[str, str]]:
+    with _FIELD_ID_LOCK:
+        last = _LAST_SAVED.get(key)
+        if last is not None:
+            _LAST_SAVED.move_to_end(key)
+        return last
+
+
+def _remember_saved(keys: List[str], sku_value: str, contact_id: str) -> None:
+    with _FIELD_ID_LOCK:
+        for key in keys:
+            _LAST_SAVED[key] = (sku_value, contact_id)
+            _LAST_SAVED.move_to_end(key)
+        while len(_LAST_SAVED) > _LAST_SAVED_MAX:
+            _LAST_SAVED.popitem(last=False)
 
 
 class SaveSelectedProductsTool(BaseTool):
@@ -24,160 +170,179 @@ class SaveSelectedProductsTool(BaseTool):
     skus: List[str] = Field(..., description="List of selected product SKUs to save (overwrites previous)")
     email: Optional[str] = Field(None, description="Optional: contact email to bind updates; otherwise session-scoped synthetic email is used")
     overwrite: bool = Field(True, description="Always overwrite previous SKUs (must be true)")
+    force: bool = Field(False, description="Optional: save even if the same SKUs were just saved for this contact")
+    verify: bool = Field(False, description="Optional: re-fetch the contact after saving instead of returning the save response")
+
+    def _find_product_skus_field(self, fields_url: str, headers: Dict[str, str], location_id: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """List the location's custom fields and return (Product SKUs field id, last error body)."""
+        try:
+            lr = _request_with_backoff("GET", fields_url, headers=headers, timeout=20)
+            try:
+                data = _json_body(lr)
+            except Exception:
+                data = {"raw": lr.text}
+            if not lr.ok:
+                return None, data
+            items = data.get("customFields") or data.get("items") or data.get("list") or []
+            by_name = {
+                str(it.get("name", "")).strip().lower(): it
+                for it in items
+                if it.get("locationId") in (None, location_id)
+            }
+            return (by_name.get("product skus") or {}).get("id"), {}
+        except Exception as e:
+            return None, {"error": str(e)}
 
     def _ensure_product_skus_field(self, token: str, location_id: str) -> str:
         """Ensure a Product SKUs custom field exists; create as TEXT if missing.
         Returns the field ID.
         """
+        cache_key = _field_cache_key(token, location_id)
+        with _FIELD_ID_LOCK:
+            cached_id = _FIELD_ID_CACHE.get(cache_key)
+        if cached_id:
+            return cached_id
+
         existing = os.getenv("HL_CF_PRODUCT_SKUS", "").strip()
         if existing:
+            with _FIELD_ID_LOCK:
+                _FIELD_ID_CACHE[cache_key] = existing
             return existing
 
-        # Try multiple endpoint/payload variants to maximize compatibility across tenants
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Version": "2021-07-28",
-            "LocationId": location_id,
-        }
-        url_variants = [
-            f"{API_BASE}/custom-fields",
-            f"{API_BASE}/customFields",
-            f"{API_BASE}/locations/{location_id}/custom-fields",
-            f"{API_BASE}/locations/{location_id}/customFields",
-        ]
-        payload_variants = [
-            {"name": "Product SKUs", "dataType": "TEXT", "locationId": location_id},
-            {"name": "Product SKUs", "dataType": "TEXT"},
-            {"name": "Product SKUs", "dataType": "TEXTBOX_LIST", "locationId": location_id},
-            {"name": "Product SKUs", "dataType": "TEXTBOX_LIST"},
-        ]
-
-        field_id: Optional[str] = None
-        last_body: Dict[str, Any] = {}
-        for url in url_variants:
-            for payload in payload_variants:
-                try:
-                    resp = requests.post(url, headers=headers, json=payload, timeout=20)
-                except Exception as e:
-                    last_body = {"error": str(e)}
-                    continue
+        headers = _auth_headers(token, location_id)
+        fields_url = f"{API_BASE}/locations/{location_id}/customFields"
+
+        # Resolve by listing first; in steady state the field already exists and this is the only request
+        field_id, last_body = self._find_product_skus_field(fields_url, headers, location_id)
+
+        # Only create the field when it is truly missing
+        if not field_id:
+            payload = {**_FIELD_CREATE_PAYLOAD, "locationId": location_id}
+            try:
+                resp = _request_with_backoff("POST", fields_url, headers=headers, json=payload, timeout=20)
                 try:
-                    body = resp.json()
+                    body = _json_body(resp)
                 except Exception:
                     body = {"raw": resp.text}
                 last_body = body
                 if resp.status_code in (200, 201):
                     field_id = (body.get("customField") or {}).get("id") or body.get("id")
-                    break
-                if resp.status_code == 409:  # already exists
-                    field_id = None
-                    break
-            if field_id is not None:
-                break
-
-        # If we did not get an id directly, try listing to discover
-        if not field_id:
-            list_variants = [
-                f"{API_BASE}/custom-fields",
-                f"{API_BASE}/customFields",
-                f"{API_BASE}/locations/{location_id}/custom-fields",
-                f"{API_BASE}/locations/{location_id}/customFields",
-            ]
-            for list_url in list_variants:
-                try:
-                    lr = requests.get(list_url, headers=headers, timeout=20)
-                except Exception as e:
-                    last_body = {"error": str(e)}
-                    continue
-                if not lr.ok:
-                    try:
-                        last_body = lr.json()
-                    except Exception:
-                        last_body = {"raw": lr.text}
-                    continue
-                try:
-                    data = lr.json()
-                except Exception:
-                    data = {"items": []}
-                items = data.get("customFields") or data.get("items") or data.get("list") or []
-                for it in items:
-                    if str(it.get("name", "")).strip().lower() == "product skus" and (it.get("locationId") in (None, location_id) or it.get("locationId") == location_id):
-                        field_id = it.get("id")
-                        break
-                if field_id:
-                    break
+                elif resp.status_code == 409:  # already exists (e.g. created concurrently)
+                    # The conflict body usually names the existing field; only re-list when it doesn't
+                    field_id = (
+                        body.get("id")
+                        or (body.get("customField") or {}).get("id")
+                        or (body.get("existing") or {}).get("id")
+                    )
+                    if not field_id:
+                        field_id, last_body = self._find_product_skus_field(fields_url, headers, location_id)
+            except Exception as e:
+                last_body = {"error": str(e)}
 
         if not field_id:
             raise RuntimeError(f"Failed to create/resolve Product SKUs field: {last_body}")
 
         # Set for current process so highlevel_client picks it up
         os.environ["HL_CF_PRODUCT_SKUS"] = field_id
+        with _FIELD_ID_LOCK:
+            _FIELD_ID_CACHE[cache_key] = field_id
         return field_id
 
+    def _fetch_contact(self, contact_id: str, headers: Dict[str, str]) -> Dict[str, Any]:
+        """Fetch a contact snapshot for the opt-in verify path; errors are returned in the body."""
+        try:
+            r = _request_with_backoff(
+                "GET",
+                f"{API_BASE}/contacts/{contact_id}",
+                headers=headers,
+                timeout=20,
+            )
+            try:
+                body = _json_body(r)
+            except Exception:
+                body = {"raw": r.text}
+            # The contact GET has no field projection, so trim unused keys before returning
+            contact = body.get("contact") if isinstance(body, dict) else None
+            if isinstance(contact, dict):
+                body["contact"] = {k: contact[k] for k in _VERIFY_CONTACT_KEYS if k in contact}
+            return body
+        except Exception as e:
+            return {"error": str(e)}
+
     def run(self) -> Dict[str, Any]:  # type: ignore[override]
-        load_dotenv()
+        if os.getenv("WP_AGENT_RELOAD_ENV"):
+            # Dev-only: pick up .env edits without restarting the process
+            load_dotenv(override=True)
 
         token = os.getenv("HIGHLEVEL_ACCESS_TOKEN") or os.getenv("HIGHLEVEL_TOKEN") or os.getenv("GHL_TOKEN")
         location_id = os.getenv("HIGHLEVEL_LOCATION_ID") or os.getenv("GHL_LOCATION_ID")
         if not token or not location_id:
             return {"status": "error", "message": "Missing HighLevel token or location id"}
+        headers = _auth_headers(token, location_id)
 
         if not self.overwrite:
             return {"status": "error", "message": "overwrite must be true; tool overwrites SKUs by design"}
 
-        # Ensure Product SKUs field exists (TEXT)
-        try:
-            field_id = self._ensure_product_skus_field(token, location_id)
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
-
-        # Save SKUs as comma-separated string
-        sku_value = ",".join([s.strip() for s in self.skus if s and str(s).strip()])
+        # Save SKUs as comma-separated string, order-preserving and without duplicates
+        sku_value = ",".join(dict.fromkeys(s2 for s in self.skus if s and (s2 := str(s).strip())))
+        if len(sku_value) > _MAX_SKU_VALUE_LEN:
+            return {"status": "error", "message": f"Selected SKUs exceed {_MAX_SKU_VALUE_LEN} characters; save fewer products"}
 
         # Prefer updating the cached session contact if available; otherwise upsert by email/session
         try:
-            from wizard_designer.utils.highlevel_client import _derive_session_key, _load_cached_contact, _resolve_field_ids  # type: ignore
+            from wizard_designer.utils.highlevel_client import _derive_session_key, _load_cached_contact  # type: ignore
         except Exception:
             _derive_session_key = None  # type: ignore
             _load_cached_contact = None  # type: ignore
-            _resolve_field_ids = None  # type: ignore
 
         result: Dict[str, Any]
         cached_contact_id: Optional[str] = None
+        skey: Optional[str] = None
         if _derive_session_key and _load_cached_contact:
             try:
                 skey = _derive_session_key()
-                cached = _load_cached_contact(skey)
-                cached_contact_id = (cached or {}).get("id")
+                cached = _load_cached_contact(skey) or {}
+                cached_contact_id = cached.get("id")
             except Exception:
                 cached_contact_id = None
 
+        # Repeat saves of the same selection (double-clicks, idempotent resubmits) need no HTTP at all
+        identity = cached_contact_id or self.email or skey
+        save_key = f"{location_id}:{identity}" if identity else None
+        last = _get_last_saved(save_key) if save_key else None
+        if last and last[0] == sku_value and not (self.force or self.verify):
+            return {"status": "success", "overwritten": True, "cached": True, "contact_id": last[1]}
+
+        # Ensure Product SKUs field exists (TEXT); memoized, so repeat runs skip the network
+        try:
+            self._ensure_product_skus_field(token, location_id)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+        verify_future: Optional[Any] = None
         if cached_contact_id:
             try:
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                    "Version": "2021-07-28",
-                    "LocationId": location_id,
-                }
-                payload: Dict[str, Any] = {"tags": ["aaas", "selected-products"]}
+                payload: Dict[str, Any] = {"tags": list(_SELECTED_TAGS)}
                 if _resolve_field_ids:
-                    fids = _resolve_field_ids()
-                    fid = fids.get("PRODUCT_SKUS")
+                    # Not memoized: HL_CF_* can change at runtime (field discovery, .env reload)
+                    fid = _resolve_field_ids().get("PRODUCT_SKUS")
                     if fid:
                         payload["customFields"] = [{"id": fid, "value": sku_value}]
-                r = requests.put(f"{API_BASE}/contacts/{cached_contact_id}", headers=headers, json=payload, timeout=30)
+                if self.verify:
+                    # The contact id is already known, so the verify GET overlaps the PUT
+                    verify_future = _get_executor().submit(self._fetch_contact, cached_contact_id, headers)
+                r = _request_with_backoff("PUT", f"{API_BASE}/contacts/{cached_contact_id}", headers=headers, json=payload, timeout=30)
                 if not r.ok:
+                    if 400 <= r.status_code < 500:
+                        # The memoized field id may be stale (field deleted, token for another tenant)
+                        _forget_field_id(token, location_id)
                     try:
-                        body = r.json()
+                        body = _json_body(r)
                     except Exception:
                         body = {"raw": r.text}
                     return {"status": "error", "message": f"Failed to update cached contact {cached_contact_id}: {r.status_code} {body}"}
                 try:
-                    result = r.json()
+                    result = _json_body(r)
                 except Exception:
                     result = {"raw": r.text}
             except Exception as e:
@@ -187,37 +352,38 @@ class SaveSelectedProductsTool(BaseTool):
             if ensure_contact:
                 result = ensure_contact(
                     email=self.email,
-                    tags=["aaas", "selected-products"],
+                    tags=list(_SELECTED_TAGS),
                     custom_fields_by_symbol={"PRODUCT_SKUS": sku_value},
                 )
             else:
                 result = upsert_contact_with_fields(
                     email=self.email,
-                    tags=["aaas", "selected-products"],
+                    tags=list(_SELECTED_TAGS),
                     custom_fields_by_symbol={"PRODUCT_SKUS": sku_value},
                 )
 
-        # Fetch contact data for return if possible
-        try:
-            contact_id = (result.get("contact") or {}).get("id") or result.get("id")
-            if not contact_id:
-                contact_id = result.get("contact_id")
-            if contact_id:
-                r = requests.get(
-                    f"{API_BASE}/contacts/{contact_id}",
-                    headers={
-                        "Authorization": f"Bearer {token}",
-                        "Accept": "application/json",
-                        "Version": "2021-07-28",
-                    },
-                    timeout=20,
-                )
-                body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {"raw": r.text}
-            else:
-                body = {"info": "contact id not returned"}
-        except Exception as e:
-            body = {"error": str(e)}
-
-        return {"status": "success", "overwritten": True, "contact": body, "contact_id": contact_id}
+        contact_id = (result.get("contact") or {}).get("id") or result.get("id") or result.get("contact_id")
+        if contact_id:
+            # The next run resolves this contact from the session cache, so key it by id as well
+            keys = [f"{location_id}:{contact_id}"]
+            if save_key and save_key != keys[0]:
+                keys.append(save_key)
+            _remember_saved(keys, sku_value, contact_id)
+        if not self.verify:
+            # The save response already carries the updated contact; skip the extra round trip
+            return {"status": "success", "overwritten": True, "contact": result, "contact_id": contact_id}
 
+        # Opt-in: fetch a fresh copy of the contact for return
+        if verify_future is not None:
+            body = verify_future.result()
+            # The GET ran alongside the PUT and may predate it; the PUT is authoritative for what it wrote
+            written = result.get("contact") if isinstance(result, dict) else None
+            snapshot = body.get("contact") if isinstance(body, dict) else None
+            if isinstance(written, dict) and isinstance(snapshot, dict):
+                snapshot.update({k: written[k] for k in ("tags", "customFields") if k in written})
+        elif contact_id:
+            body = self._fetch_contact(contact_id, headers)
+        else:
+            body = {"info": "contact id not returned"}
 
+        return {"status": "success", "overwritten": True, "contact": body, "contact_id": contact_id}
\ No newline at end of file
@@ -1,18 +1,39 @@
+import atexit
 import json
 import os
+import re
 import uuid
 import logging
 import base64
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
 from agency_swarm.tools import BaseTool  # type: ignore
 from apify_client import ApifyClient
 from dotenv import load_dotenv
 from pydantic import Field
-from openai import OpenAI
+from openai import BadRequestError, DefaultHttpxClient, OpenAI
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from wizard_designer.utils.highlevel_client import upsert_contact_with_fields
+from wizard_designer.utils import sma_cache
+
+# Optional dependencies
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
 
 def setup_logger(name: str) -> logging.Logger:
     """Create a simple console logger if not already configured."""
@@ -41,9 +62,473 @@ def get_execution_time_in_readable_format(start_time: datetime) -> str:
 
 logger = setup_logger(__name__)
 
+# Cache locations are anchored to the project root (parent of this file's directory)
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+_CACHE_DIR = os.path.join(_PROJECT_ROOT, "cache", "social_media_analyzer")
+_ANALYSIS_DIR = os.path.join(_PROJECT_ROOT, "cache", "social_media_analysis")
+_DIRS_READY = False
+# Characters not allowed in cache file names, mapped in one pass by str.translate
+_SAFE_USERNAME_TABLE = str.maketrans({"/": "_", "?": "_", "#": "_", ":": "_"})
+
+
+def _ensure_cache_dirs() -> None:
+    """Create the cache directories once per process instead of on every cache read/write."""
+    global _DIRS_READY
+    if not _DIRS_READY:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        os.makedirs(_ANALYSIS_DIR, exist_ok=True)
+        _DIRS_READY = True
+
+# Shared read-only fallback for missing nested analysis sections
+_EMPTY_DICT = MappingProxyType({})
+
+# Post keys kept for analysis with their defaults ("images" is deduped separately). The
+# defaults are shared across posts, so the sequence default is an immutable tuple.
+_POST_FIELDS = (
+    ("caption", ""),
+    ("hashtags", ()),
+    ("likesCount", 0),
+    ("commentsCount", 0),
+    ("timestamp", ""),
+    ("url", ""),
+)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Compact JSON bytes, via orjson when installed."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(obj, default=str).encode("utf-8")
+
+
+def _json_loads(data: Any) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Integer env setting; a missing or malformed value falls back to default."""
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        logger.warning("Ignoring invalid %s=%r; using %s", name, os.getenv(name), default)
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Float env setting; a missing or malformed value falls back to default."""
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        logger.warning("Ignoring invalid %s=%r; using %s", name, os.getenv(name), default)
+        return default
+
 load_dotenv()
 
 
+class _WriteBatcher:
+    """Debounced JSON file writer: saves of the same path within `interval` seconds coalesce.
+
+    run() can save the same cache file several times (comment top-up, then the final result);
+    only the last payload per path is written, by a timer thread or at interpreter exit.
+    """
+
+    def __init__(self, interval: float = 2.0):
+        self._interval = interval
+        self._dirty: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    def put(self, path: str, payload: Any) -> None:
+        with self._lock:
+            self._dirty[path] = payload
+            if self._timer is None:
+                self._timer = threading.Timer(self._interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, path: Optional[str] = None) -> None:
+        """Write pending payloads: all of them, or only `path` when given.
+
+        Writes happen under the lock so a reader flushing `path` never sees a half-written file.
+        """
+        with self._lock:
+            if path is None:
+                pending, self._dirty = self._dirty, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            elif path in self._dirty:
+                pending = {path: self._dirty.pop(path)}
+            else:
+                return
+            for p, payload in pending.items():
+                try:
+                    # Write to a temp file and swap it in, so a crash mid-write never leaves a
+                    # truncated cache file behind (os.replace is atomic on POSIX)
+                    tmp = f"{p}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(_json_dumps(payload))
+                    os.replace(tmp, p)
+                except Exception as e:
+                    logger.warning("[cache] Failed to write %s: %s", p, e)
+
+
+class _ApifyLimiter:
+    """Token bucket (requests per minute) plus a concurrency cap shared by all Apify actor calls.
+
+    Pacing calls below the account's limits up front avoids burning time on 429s and
+    queued runs when several fetches (profile, posts, comments) are in flight at once.
+    """
+
+    def __init__(self, requests_per_minute: float, concurrent_calls: int):
+        self._rate = max(requests_per_minute, 1.0) / 60.0  # tokens per second
+        self._capacity = float(max(concurrent_calls, 1))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max(concurrent_calls, 1))
+
+    def _take_token(self) -> float:
+        """Consume a token if available; otherwise return seconds to wait for the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self._rate
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        self._slots.acquire()
+        try:
+            while True:
+                wait = self._take_token()
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+            yield
+        finally:
+            self._slots.release()
+
+
+# TikTok actor input shapes, in the order they are tried
+_TIKTOK_STRATEGIES = ("profiles", "directUrls", "startUrls", "usernames", "username", "handles")
+
+# Input shapes each known actor actually accepts, best match first. Every failed shape is a
+# full actor run, so known actors skip the rest of the ladder; unknown ones (e.g. a
+# TIKTOK_ACTOR override) still try all of _TIKTOK_STRATEGIES.
+ACTOR_STRATEGIES: Dict[str, List[str]] = {
+    "clockworks/tiktok-scraper": ["directUrls", "startUrls"],
+    "clockworks/tiktok-profile-scraper": ["profiles", "directUrls"],
+    "scraptik/tiktok-api": ["profiles"],
+}
+
+# Upper bound on posts (and so images) sent to the vision model in one analysis
+_MAX_ANALYSIS_POSTS = 5
+
+_HASHTAG_RE = re.compile(r"#[\w\u00C0-\uFFFF]+")
+
+# Images smaller than this are sent as-is; re-encoding them saves little
+_IMG_RESIZE_MIN_BYTES = 60_000
+# Covers are often 1080px / 0.3-2 MB; 512px is plenty for archetype classification and
+# shrinks the base64 payload several times. SMA_IMG_MAX_DIM=0 sends originals.
+_IMG_MAX_DIM = _env_int("SMA_IMG_MAX_DIM", 512)
+
+# Shared keep-alive session for image downloads; Session is safe for concurrent GETs.
+# Kept at module level: an underscore class attribute on a pydantic BaseTool becomes a
+# per-instance private attribute whose default is deep-copied.
+_HTTP = requests.Session()
+_HTTP.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504]),
+    ),
+)
+_HTTP.headers.update({"User-Agent": "Mozilla/5.0 (compatible; SMA/1.0)", "Accept-Encoding": "gzip, deflate"})
+
+_APIFY_LIMITER = _ApifyLimiter(
+    requests_per_minute=_env_float("APIFY_RPM", 60.0),
+    concurrent_calls=_env_int("APIFY_MAX_CONCURRENCY", 6),
+)
+_APIFY_MAX_ATTEMPTS = 4
+_APIFY_BACKOFF_BASE_S = 1.0
+_APIFY_BACKOFF_CAP_S = 30.0
+
+_CACHE_WRITER = _WriteBatcher()
+
+# Field fallbacks across TikTok actor schemas, as key paths tried in order (first truthy wins)
+_FOLLOWERS_PATHS = (("fans",), ("authorStats", "followerCount"), ("followerCount",))
+_POSTS_COUNT_PATHS = (("video",), ("authorStats", "videoCount"), ("videoCount",))
+_POST_URL_PATHS = (("webVideoUrl",), ("url",), ("shareUrl",))
+_LIKES_PATHS = (("diggCount",), ("stats", "diggCount"))
+_COMMENTS_PATHS = (("commentCount",), ("stats", "commentCount"))
+_COVER_PATHS = (
+    # Common cover fields nested under 'covers'
+    ("covers", "dynamic"),
+    ("covers", "default"),
+    ("covers", "origin"),
+    ("covers", "dynamicCover"),
+    ("covers", "defaultCover"),
+    ("covers", "originCover"),
+    # Top-level fallbacks seen across actors
+    ("dynamicCover",),
+    ("defaultCover",),
+    ("originCover",),
+    ("thumbnailUrl",),
+    ("coverUrl",),
+    ("videoMeta", "cover"),
+    ("videoMeta", "coverSmall"),
+    ("video", "cover"),
+)
+
+
+def _first_path(d: Dict[str, Any], paths: Tuple[Tuple[str, ...], ...], default: Any = None) -> Any:
+    """Return the first truthy value found along any of `paths` in nested dict `d`, else default."""
+    for path in paths:
+        value: Any = d
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value:
+            return value
+    return default
+
+
+_PLATFORM_RE = re.compile(r"(instagram\.com|twitter\.com|x\.com|tiktok\.com|facebook\.com)")
+_PLATFORM_MAP = {
+    "instagram.com": "instagram",
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+    "tiktok.com": "tiktok",
+    "facebook.com": "facebook",
+}
+_HANDLE_PLATFORMS = ("tiktok", "instagram", "twitter")
+
+
+@lru_cache(maxsize=1024)
+def _platform_for_url(url: str) -> str:
+    """Platform implied by the URL's host; memoized since run() and callers re-ask for the same URL."""
+    # One regex scan instead of a substring test per platform
+    m = _PLATFORM_RE.search(url)
+    return _PLATFORM_MAP[m.group(1)] if m else "unknown"
+
+
+@lru_cache(maxsize=1024)
+def _username_for_url(url: str) -> str:
+    """Extract username from social media URL (memoized; pure function of the URL)."""
+    try:
+        # Normalize
+        if url[-1] == "/":
+            url = url[:-1]
+
+        # TikTok: prefer the segment after '/@'
+        if "tiktok.com" in url and "/@" in url:
+            after_at = url.split("/@", 1)[1]
+            # The username ends at the next '/'
+            username = after_at.split("/", 1)[0]
+        else:
+            username = url.strip("/").split("/")[-1]
+
+        if username.startswith("@"):
+            username = username[1:]
+        return username
+    except Exception:
+        return url
+
+
+def _canonical_tiktok(username_or_url: str) -> Tuple[str, str]:
+    """Return (profile_url, handle) for a TikTok handle or URL, with query and fragment dropped.
+
+    URLs without an @handle segment (e.g. vm.tiktok.com short links) are passed through
+    with an empty handle, so only the URL-based strategies are tried for them.
+    """
+    raw = username_or_url.strip()
+    if "tiktok.com" not in raw:
+        handle = urlsplit(raw).path.strip("/").lstrip("@")
+        return f"https://www.tiktok.com/@{handle}/", handle
+    parts = urlsplit(raw if "://" in raw else f"https://{raw}")
+    first = parts.path.lstrip("/").split("/", 1)[0]
+    if first.startswith("@"):
+        handle = first[1:]
+        return f"https://www.tiktok.com/@{handle}/", handle
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", "")), ""
+
+
+# Process-wide OpenAI client: building one per analysis meant a new httpx pool and TLS
+# handshake every time. Rebuilt only if OPENAI_API_KEY changes.
+_OPENAI_CLIENT: Optional[OpenAI] = None
+_OPENAI_KEY: Optional[str] = None
+_OPENAI_LOCK = threading.Lock()
+
+
+def _get_openai(api_key: str) -> OpenAI:
+    """Return the shared OpenAI client for api_key, creating it on first call."""
+    global _OPENAI_CLIENT, _OPENAI_KEY
+    if _OPENAI_CLIENT is None or _OPENAI_KEY != api_key:
+        with _OPENAI_LOCK:
+            if _OPENAI_CLIENT is None or _OPENAI_KEY != api_key:
+                http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+                )
+                _OPENAI_CLIENT = OpenAI(api_key=api_key, http_client=http_client)
+                _OPENAI_KEY = api_key
+    return _OPENAI_CLIENT
+
+
+# Process-wide Apify client, shared by every tool instance so its HTTP connection pool is
+# reused across runs. Rebuilt only if APIFY_API_TOKEN changes.
+_APIFY_CLIENT: Optional[ApifyClient] = None
+_APIFY_TOKEN: Optional[str] = None
+_APIFY_CLIENT_LOCK = threading.Lock()
+
+
+def _get_apify_client(token: str) -> ApifyClient:
+    """Return the shared ApifyClient for token, creating it on first call."""
+    global _APIFY_CLIENT, _APIFY_TOKEN
+    if _APIFY_CLIENT is None or _APIFY_TOKEN != token:
+        with _APIFY_CLIENT_LOCK:
+            if _APIFY_CLIENT is None or _APIFY_TOKEN != token:
+                _APIFY_CLIENT = ApifyClient(token)
+                _APIFY_TOKEN = token
+    return _APIFY_CLIENT
+
+
+# ---------------- GPT analysis output schema ----------------
+# Enforced through structured outputs, so the prompt no longer has to spell out every key
+# and the reply never needs JSON repair. Strict mode requires every property to be listed
+# as required and additionalProperties to be false.
+def _obj(**props: Any) -> Dict[str, Any]:
+    return {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+
+
+def _arr(items: Dict[str, Any], description: Optional[str] = None) -> Dict[str, Any]:
+    schema: Dict[str, Any] = {"type": "array", "items": items}
+    if description:
+        schema["description"] = description
+    return schema
+
+
+_STR: Dict[str, Any] = {"type": "string"}
+_NUM: Dict[str, Any] = {"type": "number"}
+_STRS = _arr(_STR)
+
+BRAND_ANALYSIS_SCHEMA: Dict[str, Any] = _obj(
+    inferred_archetype=_obj(name=_STR, confidence_0_1=_NUM, rationale=_STR),
+    archetype_candidates=_arr(_obj(name=_STR, confidence_0_1=_NUM), "Up to 2 secondary archetypes"),
+    influencer_persona=_obj(name_unknown_ok=_STR, role=_STR, traits=_STRS),
+    visual_style=_obj(dress_description=_STR, common_color_palettes=_STRS, styling_vibe_tags=_STRS),
+    synthesis_sentences=_arr(
+        _STR, "10 sentences mixing: who the influencer is; how followers aspire/think; supplement products they might buy"
+    ),
+    audience_alignment=_obj(
+        referent_audience=_obj(who=_STR, demographics=_STR, why_they_want_to_be_like_them=_STR),
+        admirer_audience=_obj(who=_STR, demographics=_STR, why_they_follow=_STR),
+        real_product_consumers=_obj(who=_STR, demographics=_STR, rationale=_STR),
+    ),
+    recommended_product_types=_arr(
+        _STR,
+        "5-10 items aligned to REAL consumers, from ONLY these categories: Men's Health, General Health, "
+        "Premium Sports Nutrition, Weight Loss & Detox, Nootropics, Women's Health/Hair/Skin/Beauty, "
+        "In-House Custom Formulas, Premium Green & Red Superfoods",
+    ),
+    marketing_angle={"type": "string", "description": "Short angle aligned to REAL consumers"},
+    brand_design_guidance=_obj(
+        sentiment=_STR,
+        tone_words=_STRS,
+        typography=_STR,
+        color_palette_hex=_STRS,
+        color_roles=_arr(_obj(hex=_STR, role_primary_secondary_accent_neutral=_STR)),
+        color_usage=_arr(_obj(hex=_STR, usage_contexts=_STRS, ratio_approx_percent=_NUM)),
+        logo_guidelines=_obj(
+            style_keywords=_STRS,
+            iconography_recommendations=_STRS,
+            typography_pairing=_STR,
+            safe_area_clearspace_rules=_STR,
+            lockup_recommendations=_STRS,
+            background_contrast_rules=_STR,
+            do=_STRS,
+            dont=_STRS,
+        ),
+        imagery_guidelines=_STR,
+        packaging_notes=_STR,
+    ),
+    brand_naming_guidelines=_obj(
+        naming_philosophy=_STR,
+        style_keywords=_STRS,
+        word_categories=_obj(
+            latin_derived=_STRS,
+            modern_tech=_STRS,
+            wellness_nature=_STRS,
+            luxury_premium=_STRS,
+            performance_energy=_STRS,
+        ),
+        naming_patterns=_STRS,
+        syllable_preference=_STR,
+        cultural_considerations=_STRS,
+        avoid_words=_STRS,
+        brand_voice_alignment=_STR,
+        influencer_alignment=_STR,
+    ),
+)
+
+# Output cap for one analysis. A complete brand_analysis object is ~2-3k tokens; the cap only
+# stops runaway generations (ANALYSIS_MAX_TOKENS overrides it).
+_ANALYSIS_MAX_TOKENS = _env_int("ANALYSIS_MAX_TOKENS", 4096)
+
+_BRAND_ANALYSIS_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {"name": "brand_analysis", "schema": BRAND_ANALYSIS_SCHEMA, "strict": True},
+}
+
+# Appended to the system prompt when falling back to JSON mode, which has no schema of its own
+_JSON_MODE_SCHEMA_PROMPT = "\nThe brand_analysis JSON schema:\n" + json.dumps(BRAND_ANALYSIS_SCHEMA, separators=(",", ":"))
+
+
+def _is_response_format_error(e: BadRequestError) -> bool:
+    """True when a 400 rejects the response_format (structured outputs unsupported)."""
+    if getattr(e, "param", None) == "response_format":
+        return True
+    message = str(e).lower()
+    return "response_format" in message or "json_schema" in message
+
+
+# Analysis prompts are fixed text; build them once at import instead of on every call
+_ARCHETYPE_SYSTEM_PROMPT = (
+    "You are a brand strategist and stylist. Analyze the influencer's first-image visuals and audience comments. "
+    "Classify the influencer into one of these archetypes (pick 1 primary, up to 2 secondary):\n"
+    "1 Gym Bros & Bodybuilders | Followers: 70% men 30% women 18-35 | Best: Protein, creatine, preworkout, BCAAs | Comments: 'split?', 'protein grams?', 'stack pls' | Angle: performance & gains.\n"
+    "2 Wellness & Yoga Gurus | Followers: 80% women 20-40 | Best: Collagen, adaptogens, detox, greens | Comments: 'morning ritual', 'matcha?', 'energy' | Angle: balance & natural health.\n"
+    "3 Biohackers & Productivity | Followers: 60% men 40% women 20-45 | Best: Nootropics, omega-3, vitamin D | Comments: 'focus stack?', 'does it work?', 'sleep improved' | Angle: brain power & longevity.\n"
+    "4 Beauty & Lifestyle | Followers: 85% women 18-35 | Best: Collagen, biotin, hair gummies, anti-aging | Comments: 'skin goals', 'routine?', 'serum + supplement?' | Angle: beauty & confidence.\n"
+    "5 Nutrition & Healthy Cooking | Followers: 70% women 30% men | Best: Protein, probiotics, greens | Comments: 'recipe pls', 'smoothie color', 'vegan?' | Angle: healthy lifestyle via food.\n"
+    "6 Plant-Based & Sustainable | Followers: 75% women 18-40 | Best: Vegan protein, B12, iron, algae omega-3 | Comments: 'vegan?', 'cruelty-free?', 'protein source?' | Angle: eco-friendly wellness.\n"
+    "7 Functional/CrossFit | Followers: 60% men 40% women 20-40 | Best: Electrolytes, BCAAs, recovery | Comments: 'WOD beast', 'recover fast?', 'stack?' | Angle: strength & peak performance.\n"
+    "8 Science-Based Educators | Followers: mixed 22-45 | Best: Creatine, omega-3, multivitamins | Comments: 'any studies?', 'evidence?', 'sources?' | Angle: trust & evidence.\n"
+    "9 Weight-Loss Coaches | Followers: 80% women 25-45 | Best: MRPs, fat burners, appetite blends | Comments: 'down 2kg', 'belly fat?', 'before/after' | Angle: fast results & motivation.\n"
+    "10 Micro/Niche Influencers | Followers: 1k-50k mixed | Best: niche supplements | Comments: 'I trust you', 'ordered', 'thanks' | Angle: authenticity & relatability.\n"
+    "11 Aesthetic Lifestyle Males | Followers: 80% women 18-30 | Best: Collagen, protein, beauty gummies, multivitamins | Comments: 'marry me', 'skin goals king', 'morning routine?' | Angle: looks, status & lifestyle.\n"
+    "Return ONLY JSON matching the brand_analysis schema. "
+    "Keep it concise and in the requested language."
+)
+
+_ARCHETYPE_USER_PROMPT = (
+    "Language: {language}. "
+    "Classify to an archetype using visuals + comments (primary + optional secondaries). "
+    "Focus on: who the influencer is, how they dress, colors, vibe (luxury, gym, etc). "
+    "Then craft 10 short sentences covering: influencer identity; follower aspiration; supplements to buy. "
+    "Identify the group that sees the influencer as a referent (aspirational) vs admirer audience. "
+    "IMPORTANT: Real product consumers are the group wanting to be LIKE the influencer (referent audience). If a male influencer attracts women, women may admire but not want to be like him; align products to those who aspire. "
+    "Align recommended products + marketing angle specifically to REAL product consumers. "
+    "In brand_design_guidance, include explicit logo generation guidelines (style, icon, type pairing, clearspace, lockups, background contrast, dos/donts). "
+    "For color palettes, specify roles (primary/secondary/accent/neutral) and when to use each with approximate percentage ratios and contexts (packaging front, headers, CTAs, backgrounds), ensuring accessible contrast. "
+    "CRITICAL: Generate comprehensive brand_naming_guidelines including naming philosophy, style keywords, naming patterns, syllable preferences, cultural considerations, words to avoid, brand voice alignment, and influencer_alignment (how names should specifically align with this influencer's persona, aesthetic, and audience)."
+)
+
+
 class SocialMediaAnalyzer(BaseTool):
     """
     Analyzes social media profiles and posts for brand development.
@@ -81,6 +566,9 @@ class SocialMediaAnalyzer(BaseTool):
     cache_max_age_minutes: int | None = Field(
         default=720, description="Max cache age in minutes before refetching (default 12h)"
     )
+    refresh: bool | None = Field(
+        default=False, description="Ignore cached Apify results and refetch (fresh results are still cached)"
+    )
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -89,10 +577,18 @@ class SocialMediaAnalyzer(BaseTool):
         if not api_token:
             # Defer hard failure to run() so schema generation still works
             logger.warning("APIFY_API_TOKEN not set; requests will fail until provided")
-        self._client = ApifyClient(api_token) if api_token else None
+        self._client = _get_apify_client(api_token) if api_token else None
         
         # Get session ID from headers for cache isolation
         self._session_id = self._get_session_id_from_headers()
+        _ensure_cache_dirs()
+        # Proxy settings are env-only; build them once instead of on every actor attempt
+        self._proxy_cfg = self._apify_proxy_config()
+        # Actor run limits also come from the environment only (no user inputs)
+        self._apify_timeout_secs = int(os.getenv("APIFY_TIMEOUT_SECS", "600"))
+        self._apify_memory_mbytes = int(os.getenv("APIFY_MEMORY_MBYTES", "4096"))
+        self._comments_timeout_secs = int(os.getenv("COMMENTS_TIMEOUT_SECS", "120"))
+        self._default_handle_platform = os.getenv("DEFAULT_HANDLE_PLATFORM", "instagram").strip().lower()
 
     def _apify_proxy_config(self) -> dict:
         """Build Apify proxy configuration from environment variables if provided."""
@@ -124,6 +620,45 @@ class SocialMediaAnalyzer(BaseTool):
         except Exception:
             return {}
 
+    def _call_actor(self, actor_name: str, **call_kwargs: Any) -> Any:
+        """Run an Apify actor through the shared limiter, backing off with full jitter on 429s."""
+        for attempt in range(_APIFY_MAX_ATTEMPTS):
+            try:
+                with _APIFY_LIMITER.acquire():
+                    return self._client.actor(actor_name).call(**call_kwargs)
+            except Exception as e:
+                # ApifyApiError carries the HTTP status; anything else is not a rate limit
+                if getattr(e, "status_code", None) != 429 or attempt == _APIFY_MAX_ATTEMPTS - 1:
+                    raise
+                delay = random.uniform(0, min(_APIFY_BACKOFF_CAP_S, _APIFY_BACKOFF_BASE_S * (2 ** attempt)))
+                logger.warning("Apify rate limited on %s; retrying in %.1fs", actor_name, delay)
+                time.sleep(delay)
+
+    def _actor_items(self, actor_name: str, run_input: dict, *, limit: int, memory_mbytes: int, timeout_secs: int) -> list:
+        """Run an actor and read up to `limit` dataset items, serving fresh results from the TTL cache."""
+        key = sma_cache.make_key(self._session_id, actor_name, {"input": run_input, "limit": limit}) if self.use_cache else None
+        if key and not self.refresh:
+            cached_items = sma_cache.get(key, max_age_s=int(self.cache_max_age_minutes or 0) * 60)
+            if cached_items is not None:
+                logger.info("[cache] Apify result hit for %s", actor_name)
+                return cached_items
+
+        run = self._call_actor(
+            actor_name,
+            run_input=run_input,
+            memory_mbytes=memory_mbytes,
+            timeout_secs=timeout_secs,
+        )
+        # iterate_items pages through the dataset and stops at `limit`, instead of
+        # materializing one ListPage response for the whole read
+        items = list(
+            self._client.dataset(run["defaultDatasetId"]).iterate_items(clean=True, limit=limit)  # type: ignore[index]
+        )
+        # Empty results are not cached so transient misses (and the TikTok strategy ladder) retry next time
+        if key and items:
+            sma_cache.put(key, items)
+        return items
+
     def _get_session_id_from_headers(self) -> str:
         """Extract session ID from agency headers or generate a new one."""
         try:
@@ -151,52 +686,48 @@ class SocialMediaAnalyzer(BaseTool):
                 value = os.getenv(env_var)
                 if value:
                     session_id = str(value)[:8]  # Use first 8 characters
-                    logger.info(f"🔍 Found session ID from header {header}: {session_id}")
+                    logger.info("🔍 Found session ID from header %s: %s", header, session_id)
                     return session_id
             
             # Fallback: generate new UUID for local development
             import uuid
             new_session_id = str(uuid.uuid4())[:8]
-            logger.info(f"🆔 Generated new session ID: {new_session_id}")
+            logger.info("🆔 Generated new session ID: %s", new_session_id)
             return new_session_id
             
         except Exception as e:
-            logger.warning(f"Error getting session ID: {e}")
+            logger.warning("Error getting session ID: %s", e)
             import uuid
             return str(uuid.uuid4())[:8]
 
     def _get_profile_data(self, request_id: str, username: str) -> list:
         """Get profile data using instagram-profile-scraper"""
-        logger.info(f"[{request_id}] Fetching profile data...")
-        logger.debug(f"Calling profile API for username: {username}")
-        # Derive timeouts/memory from environment (no user inputs)
-        timeout_secs = int(os.getenv("APIFY_TIMEOUT_SECS", "600"))
-        profile_run = self._client.actor("apify/instagram-profile-scraper").call(
-            run_input={
+        logger.info("[%s] Fetching profile data...", request_id)
+        logger.debug("Calling profile API for username: %s", username)
+        items = self._actor_items(
+            "apify/instagram-profile-scraper",
+            {
                 "usernames": [username],
             },
-            memory_mbytes=int(os.getenv("APIFY_MEMORY_MBYTES", "4096")),
-            timeout_secs=timeout_secs,
+            limit=1,
+            memory_mbytes=self._apify_memory_mbytes,
+            timeout_secs=self._apify_timeout_secs,
         )
 
         logger.info("Profile API call completed")
-        return (
-            self._client.dataset(profile_run["defaultDatasetId"])
-            .list_items(clean=True, limit=1)
-            .items
-        )
+        return items
 
     def _get_posts_data(self, request_id: str, username: str) -> list:
         """Get posts data using instagram-post-scraper"""
-        logger.info(f"[{request_id}] Fetching posts data...")
-        logger.debug(f"Calling posts API for username: {username}")
+        logger.info("[%s] Fetching posts data...", request_id)
+        logger.debug("Calling posts API for username: %s", username)
 
         # Reduce timeframe from 3 years to 1 year for faster retrieval
         one_year_ago = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
 
-        timeout_secs = int(os.getenv("APIFY_TIMEOUT_SECS", "600"))
-        posts_run = self._client.actor("apify/instagram-post-scraper").call(
-            run_input={
+        items = self._actor_items(
+            "apify/instagram-post-scraper",
+            {
                 # Use username input as expected by the actor
                 "username": [username],
                 "resultsLimit": min(int(self.max_results or 20), 50),
@@ -206,44 +737,26 @@ class SocialMediaAnalyzer(BaseTool):
                 "expandMentions": False,
                 "scrapeComments": False,
             },
-            memory_mbytes=int(os.getenv("APIFY_MEMORY_MBYTES", "4096")),
-            timeout_secs=timeout_secs,
+            limit=20,  # Match resultsLimit
+            memory_mbytes=self._apify_memory_mbytes,
+            timeout_secs=self._apify_timeout_secs,
         )
 
-        logger.info(f"Posts API call completed. Fetching posts since {one_year_ago}")
-        return (
-            self._client.dataset(posts_run["defaultDatasetId"])
-            .list_items(
-                clean=True,
-                limit=20,  # Match resultsLimit
-            )
-            .items
-        )
+        logger.info("Posts API call completed. Fetching posts since %s", one_year_ago)
+        return items
 
     def _get_tiktok_profile_and_posts(self, request_id: str, username_or_url: str) -> dict:
         """Get TikTok profile and posts using Apify TikTok actors and normalize to IG-like shape"""
-        logger.info(f"[{request_id}] Fetching TikTok data...")
-
-        # Build a profile URL if we only received a handle
-        url = username_or_url
-        if "tiktok.com" not in url:
-            handle = username_or_url.lstrip("@")
-            url = f"https://www.tiktok.com/@{handle}/"
-        # Strip query/fragment for stability
-        if "?" in url:
-            url = url.split("?", 1)[0]
-        if "#" in url:
-            url = url.split("#", 1)[0]
-
-        timeout_secs = int(os.getenv("APIFY_TIMEOUT_SECS", "600"))
+        logger.info("[%s] Fetching TikTok data...", request_id)
+
+        url, handle = _canonical_tiktok(username_or_url)
         items: list = []
 
         def _fetch_items(actor_name: str, run_input: dict) -> list:
             # Merge proxy config and ensure both resultsLimit/maxItems are set
-            proxy_cfg = self._apify_proxy_config()
             merged_input = {
                 **run_input,
-                **proxy_cfg,
+                **self._proxy_cfg,
             }
             if "resultsLimit" not in merged_input:
                 merged_input["resultsLimit"] = min(int(self.max_results or 20), 50)
@@ -255,26 +768,14 @@ class SocialMediaAnalyzer(BaseTool):
                 merged_input.setdefault("resultsPerPage", merged_input["resultsLimit"]) 
                 merged_input.setdefault("excludePinnedPosts", True)
  
-            run_loc = self._client.actor(actor_name).call(
-                run_input=merged_input,
-                memory_mbytes=int(os.getenv("APIFY_MEMORY_MBYTES", "4096")),
-                timeout_secs=timeout_secs,
-            )
-            return (
-                self._client.dataset(run_loc["defaultDatasetId"])  # type: ignore[index]
-                .list_items(clean=True, limit=min(int(self.max_results or 20), 50))
-                .items
+            return self._actor_items(
+                actor_name,
+                merged_input,
+                limit=min(int(self.max_results or 20), 50),
+                memory_mbytes=self._apify_memory_mbytes,
+                timeout_secs=self._apify_timeout_secs,
             )
 
-        handle = username_or_url.lstrip("@")
-        if "tiktok.com" in handle and "/@" in handle:
-            handle = handle.split("/@", 1)[1].split("/", 1)[0]
-        # Remove query/fragment from extracted handle
-        if "?" in handle:
-            handle = handle.split("?", 1)[0]
-        if "#" in handle:
-            handle = handle.split("#", 1)[0]
-
         # Try multiple strategies across actor candidates
         # Priority: env override -> common actors
         env_actor = (os.getenv("TIKTOK_ACTOR", "").strip() or None)
@@ -288,79 +789,49 @@ class SocialMediaAnalyzer(BaseTool):
         ]
         actor_candidates = [a for a in actor_candidates if a]
 
+        # Input payload per strategy, built once and shared by every actor attempt
+        limit = min(int(self.max_results or 20), 50)
+        payloads: Dict[str, dict] = {
+            "directUrls": {"directUrls": [url], "resultsLimit": limit},
+            "startUrls": {"startUrls": [{"url": url}], "resultsLimit": limit},
+        }
+        if handle:
+            payloads.update(
+                {
+                    "profiles": {
+                        "profiles": [handle],
+                        "resultsPerPage": min(int(self.max_results or 20), 100),
+                        "profileScrapeSections": ["videos"],
+                        "profileSorting": "latest",
+                        "excludePinnedPosts": False,
+                        "shouldDownloadVideos": False,
+                        "shouldDownloadCovers": True,
+                        "shouldDownloadSubtitles": False,
+                        "shouldDownloadSlideshowImages": False,
+                        "shouldDownloadAvatars": False,
+                    },
+                    "usernames": {"usernames": [handle], "resultsLimit": limit},
+                    "username": {"username": handle, "resultsLimit": limit},
+                    "handles": {"handles": [handle], "resultsLimit": limit},
+                }
+            )
+
         for actor_name in actor_candidates:
             if items:
                 break
-            # 1) actor-specific 'profiles' path
-            if handle and ("profile" in actor_name or "scraptik/tiktok-api" in actor_name):
-                try:
-                    items = _fetch_items(
-                        actor_name,
-                        {
-                            "profiles": [handle],
-                            "resultsPerPage": min(int(self.max_results or 20), 100),
-                            "profileScrapeSections": ["videos"],
-                            "profileSorting": "latest",
-                            "excludePinnedPosts": False,
-                            "shouldDownloadVideos": False,
-                            "shouldDownloadCovers": True,
-                            "shouldDownloadSubtitles": False,
-                            "shouldDownloadSlideshowImages": False,
-                            "shouldDownloadAvatars": False,
-                        },
-                    )
-                except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (profiles) failed: {e}")
-                    items = []
-            # 2) directUrls
-            if not items:
-                try:
-                    items = _fetch_items(
-                        actor_name,
-                        {"directUrls": [url], "resultsLimit": min(int(self.max_results or 20), 50)},
-                    )
-                except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (directUrls) failed: {e}")
-                    items = []
-            # 3) startUrls
-            if not items:
-                try:
-                    items = _fetch_items(
-                        actor_name,
-                        {"startUrls": [{"url": url}], "resultsLimit": min(int(self.max_results or 20), 50)},
-                    )
-                except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (startUrls) failed: {e}")
-                    items = []
-            # 4) usernames
-            if not items and handle:
-                try:
-                    items = _fetch_items(
-                        actor_name,
-                        {"usernames": [handle], "resultsLimit": min(int(self.max_results or 20), 50)},
-                    )
-                except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (usernames) failed: {e}")
-                    items = []
-            # 5) username (singular)
-            if not items and handle:
+            strategies = ACTOR_STRATEGIES.get(actor_name) or [
+                st for st in _TIKTOK_STRATEGIES if st != "profiles" or "profile" in actor_name
+            ]
+            for label in strategies:
+                if items:
+                    break
+                payload = payloads.get(label)
+                if payload is None:
+                    continue
                 try:
-                    items = _fetch_items(
-                        actor_name,
-                        {"username": handle, "resultsLimit": min(int(self.max_results or 20), 50)},
-                    )
+                    items = _fetch_items(actor_name, payload)
                 except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (username) failed: {e}")
-                    items = []
-            # 6) handles
-            if not items and handle:
-                try:
-                    items = _fetch_items(
-                        actor_name,
-                        {"handles": [handle], "resultsLimit": min(int(self.max_results or 20), 50)},
-                    )
-                except Exception as e:
-                    logger.warning(f"[{request_id}] {actor_name} (handles) failed: {e}")
+                    logger.warning("[%s] %s (%s) failed: %s", request_id, actor_name, label, e)
                     items = []
 
         if not items:
@@ -376,24 +847,28 @@ class SocialMediaAnalyzer(BaseTool):
             or self._extract_username(url)
         )
         full_name = author_meta.get("nickName") or author_meta.get("nickname") or ""
-        followers = (
-            author_meta.get("fans")
-            or (author_meta.get("authorStats") or {}).get("followerCount")
-            or author_meta.get("followerCount")
-            or 0
-        )
+        followers = _first_path(author_meta, _FOLLOWERS_PATHS, 0)
         signature = author_meta.get("signature") or author_meta.get("bio") or ""
         verified = bool(author_meta.get("verified"))
-        posts_count = (
-            author_meta.get("video")
-            or (author_meta.get("authorStats") or {}).get("videoCount")
-            or author_meta.get("videoCount")
-            or 0
-        )
+        posts_count = _first_path(author_meta, _POSTS_COUNT_PATHS, 0)
 
         # Normalize posts to match IG-like subset used by analyzer
+        # Only the newest posts are kept, so sort first (when every item has a numeric
+        # createTime) and stop normalizing once the output cap is reached
+        if all(isinstance(it.get("createTime"), (int, float)) for it in items):
+            items = sorted(items, key=lambda it: it["createTime"], reverse=True)
+        max_posts = min(int(self.max_results or 10), 50)
         latest_posts: list[dict] = []
+        seen_urls: set = set()
         for it in items:
+            if len(latest_posts) >= max_posts:
+                break
+            post_url = _first_path(it, _POST_URL_PATHS, "")
+            # Some actors repeat pinned/reposted videos; keep the first occurrence only
+            if post_url:
+                if post_url in seen_urls:
+                    continue
+                seen_urls.add(post_url)
             caption = it.get("text") or it.get("desc") or it.get("title") or ""
             # Extract hashtags from list or from caption
             hashtags_list = []
@@ -407,48 +882,16 @@ class SocialMediaAnalyzer(BaseTool):
                     else:
                         hashtags_list.append(f"#{name}")
             elif isinstance(caption, str):
-                # Fallback simple parse
-                for token in caption.split():
-                    if token.startswith("#"):
-                        hashtags_list.append(token)
-
-            likes = (
-                it.get("diggCount")
-                or (it.get("stats") or {}).get("diggCount")
-                or 0
-            )
-            comments = (
-                it.get("commentCount")
-                or (it.get("stats") or {}).get("commentCount")
-                or 0
-            )
+                # Fallback parse; the regex also drops trailing punctuation ("#tag," -> "#tag")
+                hashtags_list = _HASHTAG_RE.findall(caption)
+            # Case-insensitive dedupe keeps the prompt free of repeated tags
+            hashtags_list = list(dict.fromkeys(h.lower() for h in hashtags_list))
+
+            likes = _first_path(it, _LIKES_PATHS, 0)
+            comments = _first_path(it, _COMMENTS_PATHS, 0)
             timestamp = it.get("createTime") or it.get("timestamp") or ""
-            post_url = (
-                it.get("webVideoUrl")
-                or it.get("url")
-                or it.get("shareUrl")
-                or ""
-            )
             # Try to pick a representative image (cover)
-            covers = it.get("covers") or {}
-            cover_url = (
-                # Common cover fields nested under 'covers'
-                covers.get("dynamic")
-                or covers.get("default")
-                or covers.get("origin")
-                or covers.get("dynamicCover")
-                or covers.get("defaultCover")
-                or covers.get("originCover")
-                # Top-level fallbacks seen across actors
-                or it.get("dynamicCover")
-                or it.get("defaultCover")
-                or it.get("originCover")
-                or it.get("thumbnailUrl")
-                or it.get("coverUrl")
-                or (it.get("videoMeta") or {}).get("cover")
-                or (it.get("videoMeta") or {}).get("coverSmall")
-                or (it.get("video") or {}).get("cover")
-            )
+            cover_url = _first_path(it, _COVER_PATHS)
             images = [cover_url] if isinstance(cover_url, str) and cover_url else []
 
             latest_posts.append(
@@ -472,42 +915,63 @@ class SocialMediaAnalyzer(BaseTool):
             "businessCategoryName": "",
             "postsCount": int(posts_count or 0),
             # Align with IG normalized structure (downstream expects this key)
-            "latestPosts": latest_posts[: min(int(self.max_results or 10), 50)],
+            "latestPosts": latest_posts,
         }
 
         return {"profile": profile, "latestPosts": profile.get("latestPosts", [])}
 
     def _get_post_comments(self, request_id: str, post_url: str, max_comments: int) -> list:
         """Fetch comments for a single post using instagram-comment-scraper"""
-        logger.info(f"[{request_id}] Fetching comments for post: {post_url}")
-        # Dedicated timeout for comments (env-controlled)
-        per_post_timeout = int(os.getenv("COMMENTS_TIMEOUT_SECS", "120"))
+        return self._get_post_comments_batch(request_id, [post_url], max_comments).get(post_url, [])
+
+    def _get_post_comments_batch(self, request_id: str, urls: List[str], per_post: int) -> Dict[str, List[Dict[str, Any]]]:
+        """Fetch comments for several posts in one instagram-comment-scraper run; returns post URL -> comments.
+
+        One run with all URLs in directUrls pays a single actor start-up instead of one per post.
+        Items are matched back to their post by postUrl (ignoring query and trailing slash).
+        """
+        urls = list(dict.fromkeys(u for u in urls if u))
+        if not urls:
+            return {}
+        logger.info("[%s] Fetching comments for %d post(s): %s", request_id, len(urls), ", ".join(urls))
+        total = per_post * len(urls)
         try:
-            run = self._client.actor("apify/instagram-comment-scraper").call(
-                run_input={
+            items = self._actor_items(
+                "apify/instagram-comment-scraper",
+                {
                     # Actor expects directUrls for post/reel links
-                    "directUrls": [post_url],
+                    "directUrls": urls,
+                    # Per-post cap; the actor applies resultsLimit to each URL
+                    "resultsLimit": per_post,
                     # Attempt to limit scrape size server-side (actor may ignore unknown keys)
-                    "resultsLimit": max_comments,
-                    "maxItems": max_comments,
-                    # Some actors support maxItems/maxComments; we also limit via dataset read
+                    "maxItems": total,
                 },
+                limit=total,
                 memory_mbytes=1024,
-                timeout_secs=per_post_timeout,
-            )
-            items = (
-                self._client.dataset(run["defaultDatasetId"])  # type: ignore[index]
-                .list_items(clean=True, limit=max_comments)
-                .items
+                # Dedicated timeout for comments (env-controlled)
+                timeout_secs=self._comments_timeout_secs,
             )
         except Exception as e:
-            logger.warning(f"[{request_id}] Failed to fetch comments for {post_url}: {e}")
+            logger.warning("[%s] Failed to fetch comments for %s: %s", request_id, ", ".join(urls), e)
             items = []
 
-        # Normalize a compact subset of each comment
-        comments: list[dict] = []
+        def _post_key(u: str) -> str:
+            return u.split("?", 1)[0].rstrip("/")
+
+        by_key = {_post_key(u): u for u in urls}
+        comments_map: Dict[str, List[Dict[str, Any]]] = {u: [] for u in urls}
         for it in items or []:
-            comments.append(
+            post_url = by_key.get(_post_key(it.get("postUrl") or ""))
+            if post_url is None:
+                if len(urls) != 1:
+                    continue
+                # Single-URL runs: every item belongs to that post even without postUrl
+                post_url = urls[0]
+            bucket = comments_map[post_url]
+            if len(bucket) >= per_post:
+                continue
+            # Normalize a compact subset of each comment
+            bucket.append(
                 {
                     "text": it.get("text", ""),
                     "username": it.get("ownerUsername") or it.get("username", ""),
@@ -516,7 +980,7 @@ class SocialMediaAnalyzer(BaseTool):
                     "url": it.get("url", post_url),
                 }
             )
-        return comments
+        return comments_map
 
     def _first_image_url(self, post: Dict[str, Any]) -> Optional[str]:
         images = post.get("images") or []
@@ -525,112 +989,152 @@ class SocialMediaAnalyzer(BaseTool):
             return url if isinstance(url, str) else None
         return None
 
+    @staticmethod
+    def _downscale_image(raw: bytes, max_dim: int) -> Optional[bytes]:
+        """Re-encode an image as a JPEG no larger than max_dim on either side; None if undecodable."""
+        try:
+            import io
+            import PIL.Image as PILImage
+            img = PILImage.open(io.BytesIO(raw)).convert("RGB")
+            img.thumbnail((max_dim, max_dim), PILImage.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=78, optimize=True)
+            return out.getvalue()
+        except Exception:
+            return None
+
     def _url_to_data_url(self, url: str) -> Optional[str]:
+        max_dim = _IMG_MAX_DIM
         try:
-            headers = {"User-Agent": "Mozilla/5.0 (compatible; SMA/1.0)"}
-            resp = requests.get(url, headers=headers, timeout=20)
-            if resp.status_code >= 400:
-                return None
-            content_type = resp.headers.get("Content-Type", "image/jpeg")
-            b64 = base64.b64encode(resp.content).decode("utf-8")
-            return f"data:{content_type};base64,{b64}"
+            with _HTTP.get(url, timeout=20, stream=True) as resp:
+                if resp.status_code >= 400:
+                    return None
+                content_type = resp.headers.get("Content-Type", "image/jpeg")
+                size = int(resp.headers.get("Content-Length") or 0)
+                if max_dim > 0 and (not size or size >= _IMG_RESIZE_MIN_BYTES):
+                    # Resizing needs the whole image decoded, so buffer it instead of streaming
+                    raw = resp.content
+                    if len(raw) >= _IMG_RESIZE_MIN_BYTES:
+                        small = self._downscale_image(raw, max_dim)
+                        if small:
+                            return "data:image/jpeg;base64," + base64.b64encode(small).decode("ascii")
+                    return f"data:{content_type};base64," + base64.b64encode(raw).decode("ascii")
+                # Encode chunk by chunk instead of buffering the raw image; base64 needs
+                # 3-byte aligned input, so carry the 0-2 byte remainder into the next chunk
+                parts: List[bytes] = []
+                remainder = b""
+                for chunk in resp.iter_content(chunk_size=65536):
+                    if not chunk:
+                        continue
+                    chunk = remainder + chunk
+                    cut = len(chunk) - len(chunk) % 3
+                    parts.append(base64.b64encode(chunk[:cut]))
+                    remainder = chunk[cut:]
+                parts.append(base64.b64encode(remainder))
+            return f"data:{content_type};base64," + b"".join(parts).decode("ascii")
         except Exception:
             return None
 
-    def _run_gpt_analysis(self, posts: List[Dict[str, Any]], comments_map: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    def _analysis_posts(self, posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Vision latency grows with image count, so never send more than _MAX_ANALYSIS_POSTS
+        return posts[: min(int(self.analysis_posts_limit or 5), _MAX_ANALYSIS_POSTS)]
+
+    def _prefetch_images(self, posts: List[Dict[str, Any]]) -> Dict[str, Optional[str]]:
+        """Download the first image of each analyzed post as a data URL, keyed by image URL."""
+        # Convert first images to data URLs (avoids remote fetch failures/expirations).
+        # Each is a blocking CDN fetch, so run them concurrently.
+        to_fetch = [u for u in (self._first_image_url(post) for post in self._analysis_posts(posts)) if u]
+        if not to_fetch:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(8, len(to_fetch))) as ex:
+            return dict(zip(to_fetch, ex.map(self._url_to_data_url, to_fetch)))
+
+    @staticmethod
+    def _complete(
+        client: OpenAI, model: str, messages: List[Dict[str, Any]], response_format: Dict[str, Any]
+    ) -> Tuple[str, Optional[str]]:
+        """Run one chat completion; return (message text or "{}", finish_reason).
+
+        The reply is a single schema-constrained JSON object parsed only once complete, so it
+        isn't streamed; finish_reason "length" flags output cut off at max_tokens.
+        """
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.5,
+            response_format=response_format,
+            max_tokens=_ANALYSIS_MAX_TOKENS,
+        )
+        choice = response.choices[0]
+        return choice.message.content or "{}", choice.finish_reason
+
+    def _run_gpt_analysis(
+        self,
+        posts: List[Dict[str, Any]],
+        comments_map: Dict[str, List[Dict[str, Any]]],
+        fetched: Optional[Dict[str, Optional[str]]] = None,
+    ) -> Dict[str, Any]:
+        """Run the archetype analysis; `fetched` takes images already downloaded by _prefetch_images."""
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             return {"status": "error", "error": "OPENAI_API_KEY not set", "analysis": None}
 
-        client = OpenAI(api_key=api_key)
+        client = _get_openai(api_key)
 
-        # Prepare content blocks: take first image per post and a compact comments sample
+        posts = self._analysis_posts(posts)
+        image_urls = [self._first_image_url(post) for post in posts]
+        if fetched is None:
+            fetched = self._prefetch_images(posts)
+
+        # Prepare content blocks: the first image of each post back to back, then one text
+        # block holding every post's comment sample (up to 10 each), delimited by post URL
         items: List[Dict[str, Any]] = []
-        for post in posts:
-            first_image = self._first_image_url(post)
-            if first_image:
-                # Convert to data URL to avoid remote fetch failures/expirations
-                data_url = self._url_to_data_url(first_image)
-                if data_url:
-                    items.append({"type": "image_url", "image_url": {"url": data_url}})
-            # Add up to 10 comments text concatenated
+        sections: List[str] = []
+        for post, first_image in zip(posts, image_urls):
+            data_url = fetched.get(first_image) if first_image else None
+            if data_url:
+                items.append({"type": "image_url", "image_url": {"url": data_url}})
             post_url = post.get("url", "")
             comments = comments_map.get(post_url, [])
             if comments:
                 text = "\n".join([f"@{(c.get('username') or '').strip()}: {(c.get('text') or '').strip()}" for c in comments[:10]])
                 if text:
-                    items.append({"type": "text", "text": f"COMMENTS for {post_url}:\n{text}"})
+                    sections.append(f"=== POST {post_url} ===\n{text}")
+        if sections:
+            items.append({"type": "text", "text": "COMMENTS:\n" + "\n\n".join(sections)})
 
         if not items:
             return {"status": "error", "error": "No images or comments to analyze", "analysis": None}
 
-        sys_prompt = (
-            "You are a brand strategist and stylist. Analyze the influencer's first-image visuals and audience comments. "
-            "Classify the influencer into one of these archetypes (pick 1 primary, up to 2 secondary):\n"
-            "1 Gym Bros & Bodybuilders | Followers: 70% men 30% women 18-35 | Best: Protein, creatine, preworkout, BCAAs | Comments: 'split?', 'protein grams?', 'stack pls' | Angle: performance & gains.\n"
-            "2 Wellness & Yoga Gurus | Followers: 80% women 20-40 | Best: Collagen, adaptogens, detox, greens | Comments: 'morning ritual', 'matcha?', 'energy' | Angle: balance & natural health.\n"
-            "3 Biohackers & Productivity | Followers: 60% men 40% women 20-45 | Best: Nootropics, omega-3, vitamin D | Comments: 'focus stack?', 'does it work?', 'sleep improved' | Angle: brain power & longevity.\n"
-            "4 Beauty & Lifestyle | Followers: 85% women 18-35 | Best: Collagen, biotin, hair gummies, anti-aging | Comments: 'skin goals', 'routine?', 'serum + supplement?' | Angle: beauty & confidence.\n"
-            "5 Nutrition & Healthy Cooking | Followers: 70% women 30% men | Best: Protein, probiotics, greens | Comments: 'recipe pls', 'smoothie color', 'vegan?' | Angle: healthy lifestyle via food.\n"
-            "6 Plant-Based & Sustainable | Followers: 75% women 18-40 | Best: Vegan protein, B12, iron, algae omega-3 | Comments: 'vegan?', 'cruelty-free?', 'protein source?' | Angle: eco-friendly wellness.\n"
-            "7 Functional/CrossFit | Followers: 60% men 40% women 20-40 | Best: Electrolytes, BCAAs, recovery | Comments: 'WOD beast', 'recover fast?', 'stack?' | Angle: strength & peak performance.\n"
-            "8 Science-Based Educators | Followers: mixed 22-45 | Best: Creatine, omega-3, multivitamins | Comments: 'any studies?', 'evidence?', 'sources?' | Angle: trust & evidence.\n"
-            "9 Weight-Loss Coaches | Followers: 80% women 25-45 | Best: MRPs, fat burners, appetite blends | Comments: 'down 2kg', 'belly fat?', 'before/after' | Angle: fast results & motivation.\n"
-            "10 Micro/Niche Influencers | Followers: 1k-50k mixed | Best: niche supplements | Comments: 'I trust you', 'ordered', 'thanks' | Angle: authenticity & relatability.\n"
-            "11 Aesthetic Lifestyle Males | Followers: 80% women 18-30 | Best: Collagen, protein, beauty gummies, multivitamins | Comments: 'marry me', 'skin goals king', 'morning routine?' | Angle: looks, status & lifestyle.\n"
-            "Return ONLY JSON with these keys: \n"
-            "inferred_archetype: {name, confidence_0_1, rationale}, archetype_candidates: [{name, confidence_0_1}], "
-            "influencer_persona: {name_unknown_ok, role, traits}, visual_style: {dress_description, common_color_palettes, styling_vibe_tags}, "
-            "synthesis_sentences: [10 strings mixing: who the influencer is; how followers aspire/think; supplement products they might buy], "
-            "audience_alignment: {referent_audience: {who, demographics, why_they_want_to_be_like_them}, admirer_audience: {who, demographics, why_they_follow}, real_product_consumers: {who, demographics, rationale}}, "
-            "recommended_product_types: [5-10 items from ONLY these categories: Men's Health, General Health, Premium Sports Nutrition, Weight Loss & Detox, Nootropics, Women's Health/Hair/Skin/Beauty, In-House Custom Formulas, Premium Green & Red Superfoods - aligned to REAL consumers], marketing_angle: short string aligned to REAL consumers, "
-            "brand_design_guidance: {sentiment, tone_words, typography, color_palette_hex, color_roles: [{hex, role_primary_secondary_accent_neutral}], color_usage: [{hex, usage_contexts, ratio_approx_percent}], logo_guidelines: {style_keywords, iconography_recommendations, typography_pairing, safe_area_clearspace_rules, lockup_recommendations, background_contrast_rules, do: [..], dont: [..]}, imagery_guidelines, packaging_notes}, "
-            "brand_naming_guidelines: {naming_philosophy: string, style_keywords: [strings], word_categories: {latin_derived: [strings], modern_tech: [strings], wellness_nature: [strings], luxury_premium: [strings], performance_energy: [strings]}, naming_patterns: [strings], syllable_preference: string, cultural_considerations: [strings], avoid_words: [strings], brand_voice_alignment: string, influencer_alignment: string}. "
-            "Keep it concise and in the requested language."
-        )
-
-        user_prompt = (
-            f"Language: {self.analysis_language or 'en'}. "
-            "Classify to an archetype using visuals + comments (primary + optional secondaries). "
-            "Focus on: who the influencer is, how they dress, colors, vibe (luxury, gym, etc). "
-            "Then craft 10 short sentences covering: influencer identity; follower aspiration; supplements to buy. "
-            "Identify the group that sees the influencer as a referent (aspirational) vs admirer audience. "
-            "IMPORTANT: Real product consumers are the group wanting to be LIKE the influencer (referent audience). If a male influencer attracts women, women may admire but not want to be like him; align products to those who aspire. "
-            "Align recommended products + marketing angle specifically to REAL product consumers. "
-            "In brand_design_guidance, include explicit logo generation guidelines (style, icon, type pairing, clearspace, lockups, background contrast, dos/donts). "
-            "For color palettes, specify roles (primary/secondary/accent/neutral) and when to use each with approximate percentage ratios and contexts (packaging front, headers, CTAs, backgrounds), ensuring accessible contrast. "
-            "CRITICAL: Generate comprehensive brand_naming_guidelines including naming philosophy, style keywords, naming patterns, syllable preferences, cultural considerations, words to avoid, brand voice alignment, and influencer_alignment (how names should specifically align with this influencer's persona, aesthetic, and audience)."
-        )
+        user_prompt = _ARCHETYPE_USER_PROMPT.format(language=self.analysis_language or "en")
 
+        messages = [
+            {"role": "system", "content": _ARCHETYPE_SYSTEM_PROMPT},
+            {"role": "user", "content": [{"type": "text", "text": user_prompt}] + items},
+        ]
+        model = self.analysis_model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         try:
-            resp = client.chat.completions.create(
-                model=self.analysis_model or os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": [{"type": "text", "text": user_prompt}] + items},
-                ],
-                temperature=0.5,
-            )
-            content = resp.choices[0].message.content or "{}"
-            # Try to parse JSON; if not, wrap
             try:
-                parsed = json.loads(content)
-            except Exception as e:
-                logger.warning(f"Failed to parse GPT response as JSON: {e}")
-                # Try to extract JSON from markdown code blocks
-                if "```json" in content:
-                    try:
-                        json_start = content.find("```json") + 7
-                        json_end = content.find("```", json_start)
-                        if json_end > json_start:
-                            json_content = content[json_start:json_end].strip()
-                            parsed = json.loads(json_content)
-                        else:
-                            parsed = {"raw": content}
-                    except Exception:
-                        parsed = {"raw": content}
-                else:
-                    parsed = {"raw": content}
+                content, finish_reason = self._complete(client, model, messages, _BRAND_ANALYSIS_FORMAT)
+            except BadRequestError as e:
+                # Only a rejected response_format is worth a retry; a bad image or policy
+                # refusal would fail the same way again
+                if not _is_response_format_error(e):
+                    raise
+                # Models without structured outputs still support plain JSON mode, but then
+                # the schema has to travel in the prompt
+                logger.warning("Structured output rejected for %s, retrying in JSON mode: %s", model, e)
+                messages[0] = {"role": "system", "content": _ARCHETYPE_SYSTEM_PROMPT + _JSON_MODE_SCHEMA_PROMPT}
+                content, finish_reason = self._complete(client, model, messages, {"type": "json_object"})
+            if finish_reason == "length":
+                # Truncated JSON can't parse; keep the text rather than fail the request
+                logger.warning("GPT response hit max_tokens=%s; returning raw output", _ANALYSIS_MAX_TOKENS)
+                return {"status": "success", "analysis": {"raw": content}, "truncated": True}
+            try:
+                parsed = _json_loads(content)
+            except ValueError as e:  # json/orjson JSONDecodeError
+                logger.warning("Failed to parse GPT response as JSON: %s", e)
+                parsed = {"raw": content}
             return {"status": "success", "analysis": parsed}
         except Exception as e:
             return {"status": "error", "error": str(e), "analysis": None}
@@ -638,89 +1142,107 @@ class SocialMediaAnalyzer(BaseTool):
 
     # ---------------- Cache helpers ----------------
     def _cache_dir(self) -> str:
-        # Anchor cache to project root (parent of this file's directory)
-        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        path = os.path.join(project_root, "cache", "social_media_analyzer")
-        os.makedirs(path, exist_ok=True)
-        return path
+        return _CACHE_DIR
 
     def _cache_file(self, username: str) -> str:
         # Sanitize filename for cache safety
-        safe = username.replace("/", "_").replace("?", "_").replace("#", "_").replace(":", "_")
+        safe = username.translate(_SAFE_USERNAME_TABLE)
         return os.path.join(self._cache_dir(), f"{safe}_{self._session_id}.json")
 
-    def _load_cache(self, username: str) -> Optional[Dict[str, Any]]:
+    def _load_cache(self, username: str, path: Optional[str] = None) -> Optional[Dict[str, Any]]:
         try:
-            path = self._cache_file(username)
+            path = path or self._cache_file(username)
+            # A save may still be pending in the write batcher; land it so we read our own writes
+            _CACHE_WRITER.flush(path)
             if not os.path.exists(path):
-                logger.info(f"[cache] No cache file: {path}")
+                logger.info("[cache] No cache file: %s", path)
                 return None
-            with open(path, "r") as f:
-                data = json.load(f)
+            if os.path.getsize(path) < 2:  # smaller than "{}": empty or truncated
+                logger.warning("[cache] Ignoring empty cache file: %s", path)
+                return None
+            with open(path, "rb") as f:
+                data = _json_loads(f.read())
             # Allow both wrapped {saved_at, data} and raw payloads
             if isinstance(data, dict) and "data" in data and isinstance(data["data"], dict):
                 payload = data["data"]
             else:
                 payload = data
-            # Do not keep any cached analysis; force re-analysis each run
-            if isinstance(payload, dict):
-                payload.pop("analysis", None)
             # No TTL logic: always accept cache as valid
-            logger.info(f"[cache] Loaded cache for {username} from {path}")
+            logger.info("[cache] Loaded cache for %s from %s", username, path)
             return {"data": payload}
-        except Exception:
+        except Exception as e:
+            logger.warning("[cache] Failed to load cache for %s: %s", username, e)
             return None
 
-    def _save_cache(self, username: str, payload: Dict[str, Any]) -> None:
+    def _save_cache(
+        self, username: str, payload: Dict[str, Any], now_iso: Optional[str] = None, path: Optional[str] = None
+    ) -> None:
         try:
-            path = self._cache_file(username)
-            # Strip analysis before saving
-            to_store = payload.copy() if isinstance(payload, dict) else payload
-            if isinstance(to_store, dict):
-                to_store.pop("analysis", None)
-            with open(path, "w") as f:
-                json.dump({"saved_at": datetime.now().isoformat(), "data": to_store}, f)
+            path = path or self._cache_file(username)
+            # Strip analysis before saving. The write is deferred and run() keeps mutating the
+            # payload (attaching analysis, dropping posts), so store a top-level snapshot,
+            # built in one pass without the analysis key rather than copied and then popped.
+            to_store = (
+                {k: v for k, v in payload.items() if k != "analysis"} if isinstance(payload, dict) else payload
+            )
+            _CACHE_WRITER.put(path, {"saved_at": now_iso or datetime.now().isoformat(), "data": to_store})
         except Exception:
             pass
 
-    def _save_analysis(self, username: str, analysis: Dict[str, Any]) -> str:
+    def _save_analysis(self, username: str, analysis: Dict[str, Any], now: Optional[datetime] = None) -> str:
         """Save analysis results to a file for reuse by other tools"""
+        now = now or datetime.now()
         try:
-            # Create analysis directory
-            project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-            analysis_dir = os.path.join(project_root, "cache", "social_media_analysis")
-            os.makedirs(analysis_dir, exist_ok=True)
-            
             # Save analysis with session ID and timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = now.strftime("%Y%m%d_%H%M%S")
             filename = f"{username}_{self._session_id}_{timestamp}.json"
-            filepath = os.path.join(analysis_dir, filename)
+            filepath = os.path.join(_ANALYSIS_DIR, filename)
             
-            with open(filepath, "w") as f:
-                json.dump({
+            with open(filepath, "wb") as f:
+                f.write(_json_dumps({
                     "username": username,
                     "session_id": self._session_id,
-                    "saved_at": datetime.now().isoformat(),
+                    "saved_at": now.isoformat(),
                     "analysis": analysis
-                }, f, indent=2)
+                }))
             
-            logger.info(f"Analysis saved to: {filepath}")
+            logger.info("Analysis saved to: %s", filepath)
             return filepath
         except Exception as e:
-            logger.warning(f"Failed to save analysis: {e}")
+            logger.warning("Failed to save analysis: %s", e)
             return ""
 
+    def _attach_analysis(
+        self,
+        result: Dict[str, Any],
+        posts: List[Dict[str, Any]],
+        comments_map: Dict[str, List[Dict[str, Any]]],
+        username: str,
+        now: datetime,
+        images: Optional[Dict[str, Optional[str]]] = None,
+    ) -> None:
+        """Run GPT analysis on posts, attach its minimized form to result and drop result's posts."""
+        analysis = self._run_gpt_analysis(posts, comments_map, images)
+        # Save analysis for reuse by other tools and build minimal response
+        analysis_file = ""
+        if analysis.get("status") == "success":
+            analysis_file = self._save_analysis(username, analysis.get("analysis", {}), now=now)
+        minimal = {
+            "status": analysis.get("status"),
+            **self._minimize_analysis(analysis.get("analysis", {}) or {}),
+        }
+        if analysis_file:
+            minimal["file"] = analysis_file
+        result["analysis"] = minimal
+        # Remove posts from final response since they've been analyzed
+        result.pop("posts", None)
+
     def _minimize_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Return a compact subset of analysis for lightweight responses."""
         try:
-            inferred = analysis.get("inferred_archetype") or {}
-            persona = analysis.get("influencer_persona") or {}
-            visual = analysis.get("visual_style") or {}
-            products = analysis.get("recommended_product_types") or []
-            angle = analysis.get("marketing_angle") or ""
-            brand_design = analysis.get("brand_design_guidance") or {}
-            tone_words = brand_design.get("tone_words") or []
-            palette = brand_design.get("color_palette_hex") or []
+            inferred = analysis.get("inferred_archetype") or _EMPTY_DICT
+            visual = analysis.get("visual_style") or _EMPTY_DICT
+            brand_design = analysis.get("brand_design_guidance") or _EMPTY_DICT
 
             return {
                 "inferred_archetype": {
@@ -728,50 +1250,54 @@ class SocialMediaAnalyzer(BaseTool):
                     "confidence_0_1": inferred.get("confidence_0_1"),
                 },
                 "influencer_persona": {
-                    "role": persona.get("role"),
+                    "role": (analysis.get("influencer_persona") or _EMPTY_DICT).get("role"),
                 },
                 "visual_style": {
-                    "styling_vibe_tags": (visual.get("styling_vibe_tags") or [])[:5],
+                    "styling_vibe_tags": list(islice(visual.get("styling_vibe_tags") or (), 5)),
                 },
-                "recommended_product_types": list(products)[:5],
-                "marketing_angle": angle,
+                "recommended_product_types": list(islice(analysis.get("recommended_product_types") or (), 5)),
+                "marketing_angle": analysis.get("marketing_angle") or "",
                 "brand_design": {
-                    "tone_words": list(tone_words)[:3],
-                    "color_palette_hex": list(palette)[:4],
+                    "tone_words": list(islice(brand_design.get("tone_words") or (), 3)),
+                    "color_palette_hex": list(islice(brand_design.get("color_palette_hex") or (), 4)),
                 },
             }
         except Exception:
             return {}
 
-    def _filter_owner_content(self, data: Dict) -> Dict:
-        """Filter data to only include essential content for GPT analysis"""
+    def _analysis_keep(self) -> int:
+        """How many posts run() carries: the analysis window, and at least the top post for comments."""
+        return max(int(self.analysis_posts_limit or 5), 1 if self.include_comments else 0)
+
+    def _filter_owner_content(self, data: Dict, keep: Optional[int] = None) -> Dict:
+        """Filter data to only include essential content for GPT analysis.
+
+        Only the first `keep` posts (default: the analysis window) are materialized.
+        """
+        profile = data.get("profile") or {}
+        latest = profile.get("latestPosts") or []
+        if keep is None:
+            keep = self._analysis_keep()
         filtered = {
             "status": "success",
             "platform": data.get("platform", "unknown"),
             "profile": {
                 # Keep only essential profile fields
-                "username": data.get("profile", {}).get("username", ""),
-                "fullName": data.get("profile", {}).get("fullName", ""),
-                "followersCount": data.get("profile", {}).get("followersCount", 0),
-                "bio": data.get("profile", {}).get("biography", ""),
-                "verified": data.get("profile", {}).get("verified", False),
-                "businessCategoryName": data.get("profile", {}).get(
-                    "businessCategoryName", ""
-                ),
-                "postsCount": data.get("profile", {}).get("postsCount", 0),
+                "username": profile.get("username", ""),
+                "fullName": profile.get("fullName", ""),
+                "followersCount": profile.get("followersCount", 0),
+                "bio": profile.get("biography", ""),
+                "verified": profile.get("verified", False),
+                "businessCategoryName": profile.get("businessCategoryName", ""),
+                "postsCount": profile.get("postsCount", 0),
             },
             # Keep only essential post data for GPT analysis (not returned in final response)
             "posts": [
                 {
-                    "caption": post.get("caption", ""),
-                    "hashtags": post.get("hashtags", []),
-                    "likesCount": post.get("likesCount", 0),
-                    "commentsCount": post.get("commentsCount", 0),
-                    "timestamp": post.get("timestamp", ""),
-                    "url": post.get("url", ""),
-                    "images": post.get("images", []),
+                    **{k: post.get(k, default) for k, default in _POST_FIELDS},
+                    "images": list(dict.fromkeys(post.get("images") or [])),
                 }
-                for post in data.get("profile", {}).get("latestPosts", [])[:int(self.analysis_posts_limit or 5)]
+                for post in islice(latest, keep)
             ],
         }
 
@@ -783,116 +1309,82 @@ class SocialMediaAnalyzer(BaseTool):
     def run(self) -> Dict[str, Any]:
         """Execute both API calls and combine results"""
         start_time = datetime.now(timezone.utc)
+        # One local timestamp per request for metadata, cache and analysis files
+        now = datetime.now()
+        now_iso = now.isoformat()
         request_id = str(uuid.uuid4())[
             :8
         ]  # Generate a short request ID for correlation
 
         # Log request start with request ID
         logger.info(
-            f"[{request_id}] "
-            f"SocialMediaAnalyzer request received for URL: {self.profile_url}"
+            "[%s] SocialMediaAnalyzer request received for URL: %s", request_id, self.profile_url
         )
 
         try:
             if not self._client:
                 raise RuntimeError("APIFY_API_TOKEN is missing. Set it in environment variables.")
 
-            platform = self._detect_platform(self.profile_url)
+            platform = self._detect_platform(self.profile_url, self._default_handle_platform)
             username = self._extract_username(self.profile_url)
 
             logger.info(
-                f"[{request_id}] Starting analysis for {platform} profile: {username}"
+                "[%s] Starting analysis for %s profile: %s", request_id, platform, username
             )
+            # Posts carried through filtering; anything past this is discarded before analysis
+            keep = self._analysis_keep()
+            # Username and session are fixed for this run, so build the cache path once
+            cache_path = self._cache_file(username)
 
             # Try cache first if enabled
             cached: Optional[Dict[str, Any]] = None
             if self.use_cache:
-                cached = self._load_cache(username)
+                cached = self._load_cache(username, path=cache_path)
             if cached and isinstance(cached.get("data"), dict):
                 cached_result = cached["data"]
                 # Top-up comments if requested and missing
                 if self.include_comments:
                     needs_comments = any("comments" not in (p or {}) for p in cached_result.get("posts", []))
                     if needs_comments:
-                        for post in cached_result.get("posts", []):
-                            url = post.get("url")
-                            if url and "comments" not in post:
-                                post["comments"] = self._get_post_comments(request_id, url, int(self.comments_per_post or 10))
+                        missing = [p for p in cached_result.get("posts", []) if p.get("url") and "comments" not in p]
+                        fetched = self._get_post_comments_batch(
+                            request_id, [p["url"] for p in missing], int(self.comments_per_post or 10)
+                        )
+                        for post in missing:
+                            post["comments"] = fetched.get(post["url"], [])
                         if self.use_cache:
-                            self._save_cache(username, cached_result)
-                # Always run GPT analysis (no conditional check)
-                if "analysis" not in cached_result:
-                    comments_map: Dict[str, List[Dict[str, Any]]] = {}
-                    for p in cached_result.get("posts", []):
-                        url = p.get("url", "")
-                        if url and isinstance(p.get("comments"), list):
-                            comments_map[url] = p["comments"]
-                    posts_for_analysis = cached_result.get("posts", [])[: int(self.analysis_posts_limit or 5)]
-                    analysis = self._run_gpt_analysis(posts_for_analysis, comments_map)
-                    # Save analysis for reuse by other tools and build minimal response
-                    analysis_file = ""
-                    if analysis.get("status") == "success":
-                        analysis_file = self._save_analysis(username, analysis.get("analysis", {}))
-                    minimal = {
-                        "status": analysis.get("status"),
-                        **self._minimize_analysis(analysis.get("analysis", {}) or {}),
-                    }
-                    if analysis_file:
-                        minimal["file"] = analysis_file
-                    cached_result["analysis"] = minimal
-                    
-                    # Remove posts from cached result since they've been analyzed
-                    if "posts" in cached_result:
-                        del cached_result["posts"]
-                    
-                    logger.info(f"[{request_id}] Returning cached result for {username}")
-                    return cached_result
+                            self._save_cache(username, cached_result, now_iso=now_iso, path=cache_path)
+                # Always run GPT analysis: _save_cache never stores one, and _attach_analysis
+                # overwrites any left in older cache files
+                comments_map: Dict[str, List[Dict[str, Any]]] = {}
+                for p in cached_result.get("posts", []):
+                    url = p.get("url", "")
+                    if url and isinstance(p.get("comments"), list):
+                        comments_map[url] = p["comments"]
+                posts_for_analysis = cached_result.get("posts", [])[: int(self.analysis_posts_limit or 5)]
+                self._attach_analysis(cached_result, posts_for_analysis, comments_map, username, now)
+                logger.info("[%s] Returning cached result for %s", request_id, username)
+                return cached_result
 
             # TikTok branch: use TikTok scraper and normalized mapping
             if platform == "tiktok":
                 tiktok_data = self._get_tiktok_profile_and_posts(request_id, self.profile_url)
-                profile = tiktok_data.get("profile", {})
-
-                result = {
-                    "status": "success",
-                    "platform": platform,
-                    "profile": profile,
-                    "metadata": {
-                        "analyzed_at": datetime.now().isoformat(),
-                        "profile_url": self.profile_url,
-                        "request_id": request_id,
-                    },
-                }
-
-                filtered_result = self._filter_owner_content(result)
+                filtered_result = self._filter_owner_content(
+                    {"platform": platform, "profile": tiktok_data.get("profile", {})}, keep
+                )
 
                 # No TikTok comments fetching (not supported here); proceed to GPT analysis if posts exist
                 if filtered_result.get("posts"):
-                    comments_map: Dict[str, List[Dict[str, Any]]] = {}
-                    posts_for_analysis = filtered_result["posts"][: int(self.analysis_posts_limit or 5)]
-                    analysis = self._run_gpt_analysis(posts_for_analysis, comments_map)
-                    analysis_file = ""
-                    if analysis.get("status") == "success":
-                        analysis_file = self._save_analysis(username, analysis.get("analysis", {}))
-                    minimal = {
-                        "status": analysis.get("status"),
-                        **self._minimize_analysis(analysis.get("analysis", {}) or {}),
-                    }
-                    if analysis_file:
-                        minimal["file"] = analysis_file
-                    filtered_result["analysis"] = minimal
-
-                    # Remove posts from final response since they've been analyzed
-                    del filtered_result["posts"]
+                    # Already bounded by _filter_owner_content; no re-slice needed
+                    self._attach_analysis(filtered_result, filtered_result["posts"], {}, username, now)
                 else:
                     # Ensure posts key is not present in final TikTok response
-                    if "posts" in filtered_result:
-                        del filtered_result["posts"]
+                    filtered_result.pop("posts", None)
 
                 # Upsert to HighLevel and cache
                 try:
                     prof = filtered_result.get("profile", {})
-                    username_val = prof.get("username") or self._extract_username(self.profile_url)
+                    username_val = prof.get("username") or username
                     followers = int(prof.get("followersCount") or 0)
                     email = f"{username_val}@example.com"
                     cf = {
@@ -906,97 +1398,80 @@ class SocialMediaAnalyzer(BaseTool):
                         tags=["aaas", "social-media-analysis"],
                     )
                 except Exception as e:
-                    logger.warning(f"HighLevel upsert skipped: {e}")
+                    logger.warning("HighLevel upsert skipped: %s", e)
 
                 logger.info(
-                    f"[{request_id}] TikTok analysis completed successfully, execution time: {get_execution_time_in_readable_format(start_time)}."
+                    "[%s] TikTok analysis completed successfully, execution time: %s.",
+                    request_id,
+                    get_execution_time_in_readable_format(start_time),
                 )
                 if self.use_cache:
-                    self._save_cache(username, filtered_result)
+                    self._save_cache(username, filtered_result, now_iso=now_iso, path=cache_path)
                 return filtered_result
 
-            # Instagram branch (default)
-            profile_data = self._get_profile_data(request_id, username)
-
-            if not profile_data:
-                error_msg = f"No profile data retrieved for: {self.profile_url}"
-                logger.error(f"[{request_id}] {error_msg}")
-                raise ValueError(error_msg)
-
-            # Optionally fetch posts with the posts actor (fallback if profile lacks latestPosts)
-            latest_posts: List[Dict] = []
+            # Instagram branch (default). The profile and posts actors are independent, so run
+            # them side by side: wall time is the slower of the two rather than their sum.
+            ex = ThreadPoolExecutor(max_workers=2)
             try:
-                posts_data = self._get_posts_data(request_id, username)
-                if isinstance(posts_data, list):
-                    latest_posts = posts_data[: int(self.max_results or 10)]
-            except Exception as e:
-                logger.warning(f"[{request_id}] Posts fetch failed, continuing with profile data only: {e}")
-
-            profile = profile_data[0] if isinstance(profile_data, list) else {}
-            # If profile doesn't include latestPosts, insert the posts we fetched
-            if latest_posts and not profile.get("latestPosts"):
-                profile["latestPosts"] = latest_posts
+                profile_future = ex.submit(self._get_profile_data, request_id, username)
+                # Optionally fetch posts with the posts actor (fallback if profile lacks latestPosts)
+                posts_future = ex.submit(self._get_posts_data, request_id, username)
+
+                profile_data = profile_future.result()
+                if not profile_data:
+                    error_msg = f"No profile data retrieved for: {self.profile_url}"
+                    logger.error("[%s] %s", request_id, error_msg)
+                    raise ValueError(error_msg)
+
+                profile = profile_data[0] if isinstance(profile_data, list) else {}
+                # The posts run is speculative: it is only used when the profile lacks latestPosts,
+                # so otherwise don't wait for it (its result still lands in the Apify cache)
+                if not profile.get("latestPosts"):
+                    latest_posts: List[Dict] = []
+                    try:
+                        posts_data = posts_future.result()
+                        if isinstance(posts_data, list):
+                            latest_posts = posts_data[: int(self.max_results or 10)]
+                    except Exception as e:
+                        logger.warning("[%s] Posts fetch failed, continuing with profile data only: %s", request_id, e)
+                    # If profile doesn't include latestPosts, insert the posts we fetched
+                    if latest_posts:
+                        profile["latestPosts"] = latest_posts
+            finally:
+                # Don't block on a posts run whose result is no longer needed
+                ex.shutdown(wait=False)
 
             # Filter for owner's content only
-            result = {
-                "status": "success",
-                "platform": platform,
-                "profile": profile,
-                "metadata": {
-                    "analyzed_at": datetime.now().isoformat(),
-                    "profile_url": self.profile_url,
-                    "request_id": request_id,
-                },
-            }
-
-            filtered_result = self._filter_owner_content(result)
-
-            # Always enrich comments for top posts (by likes) - Instagram only
-            if (
-                self.include_comments
-                and filtered_result.get("posts")
-                and (filtered_result.get("platform") == "instagram")
-            ):
-                posts_sorted = sorted(
-                    filtered_result["posts"], key=lambda p: int(p.get("likesCount", 0)), reverse=True
-                )
-                top_post = posts_sorted[0] if posts_sorted else None
-                max_comments = max(0, int(self.comments_per_post or 10))
-                if top_post and max_comments > 0:
-                    url = top_post.get("url")
-                    if url:
-                        top_post["comments"] = self._get_post_comments(request_id, url, max_comments)
+            filtered_result = self._filter_owner_content({"platform": platform, "profile": profile}, keep)
 
             # Always run GPT analysis using first images and comments
             if filtered_result.get("posts"):
-                # Build map url->comments for quick lookup
-                comments_map: Dict[str, List[Dict[str, Any]]] = {}
-                for p in filtered_result["posts"]:
-                    url = p.get("url", "")
-                    if url and isinstance(p.get("comments"), list):
-                        comments_map[url] = p["comments"]
-
-                posts_for_analysis = filtered_result["posts"][: int(self.analysis_posts_limit or 5)]
-                analysis = self._run_gpt_analysis(posts_for_analysis, comments_map)
-                # Save analysis for reuse by other tools and build minimal response
-                analysis_file = ""
-                if analysis.get("status") == "success":
-                    analysis_file = self._save_analysis(username, analysis.get("analysis", {}))
-                minimal = {
-                    "status": analysis.get("status"),
-                    **self._minimize_analysis(analysis.get("analysis", {}) or {}),
-                }
-                if analysis_file:
-                    minimal["file"] = analysis_file
-                filtered_result["analysis"] = minimal
-                
-                # Remove posts from final response since they've been analyzed
-                del filtered_result["posts"]
+                # Already bounded by _filter_owner_content; no re-slice needed
+                posts_for_analysis = filtered_result["posts"]
+                # Image downloads don't depend on comments, so they run while the comments actor does
+                with ThreadPoolExecutor(max_workers=1) as img_ex:
+                    images_future = img_ex.submit(self._prefetch_images, posts_for_analysis)
+
+                    # Always enrich comments for top posts (by likes) - Instagram only. Filtered
+                    # posts carry no comments of their own, so the map is just the top post's.
+                    comments_map: Dict[str, List[Dict[str, Any]]] = {}
+                    if self.include_comments and filtered_result.get("platform") == "instagram":
+                        # Single linear pass for the top-1 post; no full sort
+                        top_post = max(posts_for_analysis, key=lambda p: int(p.get("likesCount", 0)))
+                        max_comments = max(0, int(self.comments_per_post or 10))
+                        url = top_post.get("url")
+                        if url and max_comments > 0:
+                            top_post["comments"] = self._get_post_comments(request_id, url, max_comments)
+                            comments_map[url] = top_post["comments"]
+
+                    self._attach_analysis(
+                        filtered_result, posts_for_analysis, comments_map, username, now, images_future.result()
+                    )
 
             # --- NEW: Upsert HighLevel contact with social media info ---
             try:
                 prof = filtered_result.get("profile", {})
-                username_val = prof.get("username") or self._extract_username(self.profile_url)
+                username_val = prof.get("username") or username
                 followers = int(prof.get("followersCount") or 0)
                 # Use a synthetic email as identifier unless provided later
                 email = f"{username_val}@example.com"
@@ -1022,47 +1497,47 @@ class SocialMediaAnalyzer(BaseTool):
                         tags=["aaas", "social-media-analysis"],
                     )
             except Exception as e:
-                logger.warning(f"HighLevel upsert skipped: {e}")
+                logger.warning("HighLevel upsert skipped: %s", e)
             logger.info(
-                f"[{request_id}] Analysis completed successfully with "
-                f"GPT analysis and brand naming insights, "
-                f"execution time: "
-                f"{get_execution_time_in_readable_format(start_time)}."
+                "[%s] Analysis completed successfully with "
+                "GPT analysis and brand naming insights, "
+                "execution time: %s.",
+                request_id,
+                get_execution_time_in_readable_format(start_time),
             )
             # Save to cache
             if self.use_cache:
-                self._save_cache(username, filtered_result)
+                self._save_cache(username, filtered_result, now_iso=now_iso, path=cache_path)
             return filtered_result
 
         except Exception as e:
             error_msg = str(e)
             logger.error(
-                f"[{request_id}] Error during analysis: {error_msg}", exc_info=True
+                "[%s] Error during analysis: %s", request_id, error_msg, exc_info=True
             )
             return {
                 "status": "error",
                 "error": error_msg,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now_iso,
                 "request_id": request_id,
                 "profile_url": self.profile_url,
             }
 
     @staticmethod
-    def _detect_platform(url: str) -> str:
-        """Detect social media platform from URL"""
-        if "instagram.com" in url:
-            return "instagram"
-        elif "twitter.com" in url or "x.com" in url:
-            return "twitter"
-        elif "tiktok.com" in url:
-            return "tiktok"
-        elif "facebook.com" in url:
-            return "facebook"
+    def _detect_platform(url: str, default_handle_platform: Optional[str] = None) -> str:
+        """Detect social media platform from URL.
+
+        Bare @handles map to default_handle_platform (DEFAULT_HANDLE_PLATFORM when not given).
+        """
+        platform = _platform_for_url(url)
+        if platform != "unknown":
+            return platform
         # Allow environment-based default for bare @handles
         try:
             if url.strip().startswith("@"):
-                default_handle_platform = os.getenv("DEFAULT_HANDLE_PLATFORM", "instagram").strip().lower()
-                if default_handle_platform in ("tiktok", "instagram", "twitter"):
+                if default_handle_platform is None:
+                    default_handle_platform = os.getenv("DEFAULT_HANDLE_PLATFORM", "instagram").strip().lower()
+                if default_handle_platform in _HANDLE_PLATFORMS:
                     return default_handle_platform
         except Exception:
             pass
@@ -1071,26 +1546,7 @@ class SocialMediaAnalyzer(BaseTool):
     @staticmethod
     def _extract_username(url: str) -> str:
         """Extract username from social media URL"""
-
-        try:
-            # Normalize
-            if url[-1] == "/":
-                url = url[:-1]
-
-            # TikTok: prefer the segment after '/@'
-            if "tiktok.com" in url and "/@" in url:
-                after_at = url.split("/@", 1)[1]
-                # The username ends at the next '/'
-                username = after_at.split("/", 1)[0]
-            else:
-                username = url.strip("/").split("/")[-1]
-
-            if username.startswith("@"):
-                username = username[1:]
-            return username
-        except Exception:
-            return url
-
+        return _username_for_url(url)
 
 if __name__ == "__main__":
     try:
@@ -1099,7 +1555,7 @@ if __name__ == "__main__":
         if not test_instagram_profile:
             test_instagram_profile = "https://www.instagram.com/choi3an/"
             logger.info(
-                f"TEST_INSTAGRAM_PROFILE not set, using fallback: {test_instagram_profile}"
+                "TEST_INSTAGRAM_PROFILE not set, using fallback: %s", test_instagram_profile
             )
 
         # TikTok test handle or URL
@@ -1112,7 +1568,7 @@ if __name__ == "__main__":
         analyzer_with_at = SocialMediaAnalyzer(
             profile_url=test_profile_with_at, max_results=5, debug=True
         )
-        logger.info(f"Running analysis for: {test_profile_with_at}")
+        logger.info("Running analysis for: %s", test_profile_with_at)
         result_with_at = analyzer_with_at.run()
         print(f"IG @handle test status: {result_with_at.get('status', 'unknown')}")
 
@@ -1128,7 +1584,7 @@ if __name__ == "__main__":
             use_cache=True,
             cache_max_age_minutes=720
         )
-        logger.info(f"Running analysis for: {test_instagram_profile}")
+        logger.info("Running analysis for: %s", test_instagram_profile)
         result_ig = analyzer_ig.run()
         print(json.dumps({"ig_status": result_ig.get('status', 'unknown')}, indent=2))
 
@@ -1142,10 +1598,10 @@ if __name__ == "__main__":
             analysis_language="en",
             use_cache=True
         )
-        logger.info(f"Running analysis for: {test_tiktok_profile}")
+        logger.info("Running analysis for: %s", test_tiktok_profile)
         result_tt = analyzer_tt.run()
         print(json.dumps({"tt_status": result_tt.get('status', 'unknown')}, indent=2))
 
     except Exception as e:
-        logger.error(f"Test execution failed: {str(e)}", exc_info=True)
+        logger.error("Test execution failed: %s", e, exc_info=True)
         print(f"Error: {str(e)}")
@@ -1,51 +1,156 @@
 import os
 import json
-from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache, lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Optional dependencies
+try:
+    from requests_toolbelt import MultipartEncoder  # type: ignore
+except Exception:
+    MultipartEncoder = None  # type: ignore
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
 
 
 API_BASE = "https://services.leadconnectorhq.com"
 
+# Shared keep-alive session for every HighLevel call (v2 and the v1 media fallback), so only
+# the first request to each host pays the TCP + TLS handshake. The adapter keeps one pool
+# per host, which covers both services.leadconnectorhq.com and rest.gohighlevel.com.
+# Transient 429/5xx are retried on the same URL with exponential backoff (Retry-After wins);
+# once retries run out the last response is returned so callers' r.ok checks still apply.
+class _HLRetry(Retry):
+    """GET/PUT retry on 429/5xx. POST (contact upserts, field creates) only retries a 429,
+    which the server rejected unprocessed; a 5xx or read error may already have created
+    the record, and resending would duplicate it."""
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST":
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+_RETRY = _HLRetry(
+    total=3,
+    backoff_factor=1.0,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "PUT"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=_RETRY))
+# The v1 API (media upload fallback only) gets its own small pool and a gentler retry policy
+_V1_BASE = "https://rest.gohighlevel.com"
+_SESSION.mount(
+    _V1_BASE,
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=_HLRetry(
+            total=2,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "PUT"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+@cache
+def _ensure_env() -> None:
+    """Load .env once, on first use rather than at import, so importers that never call
+    HighLevel skip the file scan."""
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv(override=False)
+    except Exception:
+        pass
+
 
 def _env(name: str, default: str = "") -> str:
+    _ensure_env()
     v = os.getenv(name)
-    return v if v is not None and str(v).strip() != "" else default
+    return v if v is not None and v.strip() != "" else default
+
+
+# Credential env vars, in priority order
+_TOKEN_KEYS = ("HIGHLEVEL_ACCESS_TOKEN", "HIGHLEVEL_TOKEN", "GHL_TOKEN")
+_LOCATION_KEYS = ("HIGHLEVEL_LOCATION_ID", "GHL_LOCATION_ID")
+_V1_TOKEN_KEYS = ("GHL_API_KEY", "HIGHLEVEL_API_KEY", "GHL_V1_API_KEY")
+
+
+def _first_env(keys: Tuple[str, ...]) -> str:
+    return next((v for k in keys if (v := _env(k))), "")
+
+
+def _get_token() -> str:
+    return _first_env(_TOKEN_KEYS)
+
+
+def _get_location_id() -> str:
+    return _first_env(_LOCATION_KEYS)
+
+
+def _get_v1_token() -> str:
+    return _first_env(_V1_TOKEN_KEYS)
 
 
-def _headers(token: str, location_id: Optional[str] = None) -> Dict[str, str]:
+@lru_cache(maxsize=8)
+def _headers_cached(token: str, location_id: str, with_ct: bool) -> Mapping[str, str]:
+    # Read-only so the shared per-(token, location) dict can't be mutated by a caller
     h = {
         "Authorization": f"Bearer {token}",
         "Accept": "application/json",
-        "Content-Type": "application/json",
         "Version": "2021-07-28",
     }
+    if with_ct:
+        h["Content-Type"] = "application/json"
     if location_id:
         h["LocationId"] = location_id
-    return h
+    return MappingProxyType(h)
 
 
-# Load .env once on import so credentials are available when tools call helpers
-try:
-    load_dotenv(override=False)
-except Exception:
-    pass
+def _headers(token: str, location_id: Optional[str] = None) -> Mapping[str, str]:
+    return _headers_cached(token, location_id or "", True)
+
+
+# (symbol, env var, fallback id created earlier)
+_FIELD_ID_ENV = (
+    ("IG_HANDLE", "HL_CF_IG_HANDLE", "qeGZxU9HDjLh4fqox8P0"),
+    ("IG_FOLLOWERS", "HL_CF_IG_FOLLOWERS", "TnOg3Hx3oQYvZ8XFkdzF"),
+    ("TIKTOK_HANDLE", "HL_CF_TIKTOK_HANDLE", "jGSnwEscvSll6T777l8G"),
+    ("TIKTOK_FOLLOWERS", "HL_CF_TIKTOK_FOLLOWERS", "R8gkuL48aUJxnC2INpHy"),
+    ("BRAND_NAME", "HL_CF_BRAND_NAME", "THAfasnMIWf5rAPC4YJI"),
+    ("LOGO_URL", "HL_CF_LOGO_URL", "8oJXwurKogmEUNfsByPE"),
+    ("PRODUCT_MOCKUP_URL", "HL_CF_PRODUCT_MOCKUP_URL", "vrZmKfqO3ntKXYFpQKji"),
+    # Product SKUs pending - optional
+    ("PRODUCT_SKUS", "HL_CF_PRODUCT_SKUS", ""),
+)
 
 
 def _resolve_field_ids() -> Dict[str, str]:
-    """Resolve custom field IDs from env with sensible fallbacks (created earlier)."""
-    return {
-        "IG_HANDLE": _env("HL_CF_IG_HANDLE", "qeGZxU9HDjLh4fqox8P0"),
-        "IG_FOLLOWERS": _env("HL_CF_IG_FOLLOWERS", "TnOg3Hx3oQYvZ8XFkdzF"),
-        "TIKTOK_HANDLE": _env("HL_CF_TIKTOK_HANDLE", "jGSnwEscvSll6T777l8G"),
-        "TIKTOK_FOLLOWERS": _env("HL_CF_TIKTOK_FOLLOWERS", "R8gkuL48aUJxnC2INpHy"),
-        "BRAND_NAME": _env("HL_CF_BRAND_NAME", "THAfasnMIWf5rAPC4YJI"),
-        "LOGO_URL": _env("HL_CF_LOGO_URL", "8oJXwurKogmEUNfsByPE"),
-        "PRODUCT_MOCKUP_URL": _env("HL_CF_PRODUCT_MOCKUP_URL", "vrZmKfqO3ntKXYFpQKji"),
-        # Product SKUs pending - optional
-        "PRODUCT_SKUS": _env("HL_CF_PRODUCT_SKUS", ""),
-    }
+    """Resolve custom field IDs from env with sensible fallbacks (created earlier).
+
+    Not memoized: tools set HL_CF_* at runtime (e.g. HL_CF_PRODUCT_SKUS once that field is created).
+    """
+    return {sym: _env(var, default) for sym, var, default in _FIELD_ID_ENV}
 
 
 def _guess_mime_type(path: str) -> str:
@@ -57,15 +162,133 @@ def _guess_mime_type(path: str) -> str:
         return "application/octet-stream"
 
 
+# v2 media upload URL variant that last accepted a file, per location. Persisted under
+# _cache_dir() so a restart doesn't re-probe (and re-upload to) the failing variants.
+_UPLOAD_URL_FILE = "upload_endpoint.json"
+_WORKING_UPLOAD_URL: Dict[str, str] = {}
+_UPLOAD_URL_LOADED = False
+_UPLOAD_URL_LOCK = threading.Lock()
+
+
+def _known_upload_url(location_id: Optional[str]) -> Optional[str]:
+    global _UPLOAD_URL_LOADED
+    with _UPLOAD_URL_LOCK:
+        if not _UPLOAD_URL_LOADED:
+            _UPLOAD_URL_LOADED = True
+            try:
+                with open(os.path.join(_cache_dir(), _UPLOAD_URL_FILE), "rb") as f:
+                    data = _json_loads(f.read())
+                if isinstance(data, dict):
+                    _WORKING_UPLOAD_URL.update({k: v for k, v in data.items() if isinstance(v, str)})
+            except Exception:
+                pass
+        return _WORKING_UPLOAD_URL.get(location_id or "")
+
+
+def _remember_upload_url(location_id: Optional[str], url: str) -> None:
+    with _UPLOAD_URL_LOCK:
+        if _WORKING_UPLOAD_URL.get(location_id or "") == url:
+            return
+        _WORKING_UPLOAD_URL[location_id or ""] = url
+        snapshot = dict(_WORKING_UPLOAD_URL)
+    try:
+        path = os.path.join(_cache_dir(), _UPLOAD_URL_FILE)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_json_dumps(snapshot))
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Compact JSON bytes, via orjson when installed."""
+    if orjson:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str).encode("utf-8")
+
+
+def _json_loads(data: Any) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _sub_dict(d: Dict[str, Any], key: str) -> Dict[str, Any]:
+    """d[key] when it is a dict, else {} (response shapes vary across endpoint variants)."""
+    v = d.get(key)
+    return v if isinstance(v, dict) else {}
+
+
+def _is_auth_error(e: requests.RequestException) -> bool:
+    """401/403: the credentials are rejected, so no other URL variant will accept them either."""
+    resp = getattr(e, "response", None)
+    return resp is not None and resp.status_code in (401, 403)
+
+
+def _json_body(resp: requests.Response) -> Any:
+    """Raise HTTPError for an error status (after the adapter's retries), else decode the body.
+
+    An empty body decodes to {} and a non-JSON one to {"raw": text}.
+    """
+    resp.raise_for_status()
+    if not resp.content:
+        return {}
+    try:
+        return _json_loads(resp.content)
+    except ValueError:
+        return {"raw": resp.text}
+
+
+# Uploads at least this big are streamed through MultipartEncoder instead of being built in memory
+_LARGE_UPLOAD_BYTES = 5 * 1024 * 1024
+
+# Streamed uploads bypass the adapter retries: urllib3 can't rewind a MultipartEncoder, so a
+# replay would send an empty body under the original Content-Length. _post_file retries them
+# itself, rewinding the file and building a fresh encoder per attempt.
+_STREAM_SESSION = requests.Session()
+_STREAM_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+_STREAM_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+_STREAM_MAX_ATTEMPTS = 3
+_STREAM_BACKOFF_BASE_S = 1.0
+_STREAM_BACKOFF_CAP_S = 30.0
+
+
+def _post_file(
+    url: str, headers: Mapping[str, str], f: Any, name: str, ctype: str, large: bool
+) -> requests.Response:
+    """POST f as the multipart "file" field, rewound first so every attempt sends the whole file.
+
+    Large files are streamed when requests-toolbelt is installed, with their own retry loop on
+    429/5xx (see _STREAM_SESSION); small files keep the buffered body the adapter can replay.
+    """
+    if large and MultipartEncoder is not None:
+        for attempt in range(_STREAM_MAX_ATTEMPTS):
+            f.seek(0)
+            enc = MultipartEncoder(fields={"file": (name, f, ctype)})
+            r = _STREAM_SESSION.post(
+                url, headers={**headers, "Content-Type": enc.content_type}, data=enc, timeout=60
+            )
+            if r.status_code not in _STREAM_RETRY_STATUSES or attempt == _STREAM_MAX_ATTEMPTS - 1:
+                return r
+            try:
+                delay = float(r.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = _STREAM_BACKOFF_BASE_S * (2 ** attempt)
+            r.close()
+            time.sleep(min(_STREAM_BACKOFF_CAP_S, max(0.0, delay)))
+    f.seek(0)
+    return _SESSION.post(url, headers=headers, files={"file": (name, f, ctype)}, timeout=60)
+
+
 def upload_media(file_path: str, filename: Optional[str] = None, content_type: Optional[str] = None) -> Dict[str, Any]:
     """Upload a local file to HighLevel Media Storage and return a dict with best-effort URL.
 
-    Tries multiple v2 endpoint variants and finally v1 if configured. Returns:
+    Tries the v2 endpoint variant that last worked first, then the others (files of 5 MB or more
+    only try the first), and finally v1 if configured. Returns:
     {"ok": bool, "url": str|None, "raw": any, "error": str|None}
     """
-    token = _env("HIGHLEVEL_ACCESS_TOKEN") or _env("HIGHLEVEL_TOKEN") or _env("GHL_TOKEN")
-    location_id = _env("HIGHLEVEL_LOCATION_ID") or _env("GHL_LOCATION_ID")
-    v1_token = _env("GHL_API_KEY") or _env("HIGHLEVEL_API_KEY") or _env("GHL_V1_API_KEY")
+    token = _get_token()
+    location_id = _get_location_id()
+    v1_token = _get_v1_token()
     if not token and not v1_token:
         return {"ok": False, "error": "Missing HIGHLEVEL_ACCESS_TOKEN or GHL_API_KEY"}
 
@@ -78,17 +301,10 @@ def upload_media(file_path: str, filename: Optional[str] = None, content_type: O
     except Exception as e:
         return {"ok": False, "error": f"Open file failed: {e}"}
 
-    def _headers_no_ct(tok: str, loc: Optional[str]) -> Dict[str, str]:
-        h = {
-            "Authorization": f"Bearer {tok}",
-            "Accept": "application/json",
-            "Version": "2021-07-28",
-        }
-        if loc:
-            h["LocationId"] = loc
-        return h
-
-    files = {"file": (name, f, ctype)}
+    try:
+        large = os.fstat(f.fileno()).st_size >= _LARGE_UPLOAD_BYTES
+    except Exception:
+        large = False
     v2_urls = [
         f"{API_BASE}/media/upload",
         f"{API_BASE}/media",
@@ -102,47 +318,49 @@ def upload_media(file_path: str, filename: Optional[str] = None, content_type: O
     try:
         # Try v2 variants first
         if token:
+            # Multipart uploads set their own Content-Type
+            upload_headers = _headers_cached(token, location_id or "", False)
+            known = _known_upload_url(location_id)
+            if known in v2_urls:
+                v2_urls.remove(known)
+                v2_urls.insert(0, known)
+            if large:
+                # Every probe re-sends the whole file, so big uploads only try the known-good
+                # (or first) variant before the v1 fallback
+                v2_urls = v2_urls[:1]
             for url in v2_urls:
                 try:
-                    r = requests.post(url, headers=_headers_no_ct(token, location_id), files=files, timeout=60)
-                    if r.ok:
-                        try:
-                            data = r.json()
-                        except Exception:
-                            data = {"raw": r.text}
-                        # Common fields seen across variants
-                        url_val = (
-                            (data.get("fileUrl") if isinstance(data, dict) else None)
-                            or (data.get("url") if isinstance(data, dict) else None)
-                            or (data.get("secureUrl") if isinstance(data, dict) else None)
-                            or (data.get("media", {}).get("url") if isinstance(data, dict) else None)
-                        )
-                        return {"ok": True, "url": url_val, "raw": data}
-                except Exception:
+                    data = _json_body(_post_file(url, upload_headers, f, name, ctype, large))
+                except requests.RequestException as e:
+                    if _is_auth_error(e):
+                        # Token rejected: skip the remaining v2 variants, v1 uses its own key
+                        break
+                    # Wrong variant (404/405) or retries exhausted; try the next one
                     continue
+                # Common fields seen across variants
+                url_val = (
+                    (data.get("fileUrl") if isinstance(data, dict) else None)
+                    or (data.get("url") if isinstance(data, dict) else None)
+                    or (data.get("secureUrl") if isinstance(data, dict) else None)
+                    or (_sub_dict(data, "media").get("url") if isinstance(data, dict) else None)
+                )
+                _remember_upload_url(location_id, url)
+                return {"ok": True, "url": url_val, "raw": data}
 
         # Fallback to v1 if configured
         if v1_token:
-            v1_base = "https://rest.gohighlevel.com/v1"
+            v1_base = f"{_V1_BASE}/v1"
             try:
-                r1 = requests.post(
-                    f"{v1_base}/media",
-                    headers={"Authorization": f"Bearer {v1_token}"},
-                    files=files,
-                    timeout=60,
+                data1 = _json_body(_post_file(
+                    f"{v1_base}/media", {"Authorization": f"Bearer {v1_token}"}, f, name, ctype, large
+                ))
+                url_val = (
+                    (data1.get("fileUrl") if isinstance(data1, dict) else None)
+                    or (data1.get("url") if isinstance(data1, dict) else None)
+                    or (data1.get("secureUrl") if isinstance(data1, dict) else None)
                 )
-                if r1.ok:
-                    try:
-                        data1 = r1.json()
-                    except Exception:
-                        data1 = {"raw": r1.text}
-                    url_val = (
-                        (data1.get("fileUrl") if isinstance(data1, dict) else None)
-                        or (data1.get("url") if isinstance(data1, dict) else None)
-                        or (data1.get("secureUrl") if isinstance(data1, dict) else None)
-                    )
-                    return {"ok": True, "url": url_val, "raw": data1}
-            except Exception:
+                return {"ok": True, "url": url_val, "raw": data1}
+            except requests.RequestException:
                 pass
     finally:
         try:
@@ -153,6 +371,14 @@ def upload_media(file_path: str, filename: Optional[str] = None, content_type: O
     return {"ok": False, "error": "All media upload attempts failed"}
 
 
+# Custom-field list URL variant that last answered, per location; skips re-probing all variants
+_WORKING_CF_URL: Dict[str, str] = {}
+# Response keys that carry the custom-field list across endpoint variants
+_CF_LIST_KEYS = ("customFields", "items", "list")
+# Last (ETag, items) per (location, URL): unchanged lists come back as bodiless 304s
+_CF_ETAG: Dict[Tuple[str, str], Tuple[str, List[Dict[str, Any]]]] = {}
+
+
 def _list_custom_fields(token: str, location_id: Optional[str]) -> List[Dict[str, Any]]:
     urls = [
         f"{API_BASE}/custom-fields",
@@ -163,40 +389,103 @@ def _list_custom_fields(token: str, location_id: Optional[str]) -> List[Dict[str
             f"{API_BASE}/locations/{location_id}/custom-fields",
             f"{API_BASE}/locations/{location_id}/customFields",
         ])
-    for u in urls:
+    headers = _headers(token, location_id)
+    cache_key = location_id or ""
+
+    def _probe(u: str) -> Optional[List[Dict[str, Any]]]:
+        etag_key = (cache_key, u)
+        prev = _CF_ETAG.get(etag_key)
+        r = _SESSION.get(u, headers={**headers, "If-None-Match": prev[0]} if prev else headers, timeout=30)
+        if r.status_code == 304 and prev:
+            return prev[1]
+        data = _json_body(r)
+        # Only a payload that actually carries a field list counts as an answer; a non-JSON 2xx
+        # (decoded to {"raw": ...}, e.g. a gateway page) must not win the probe or get pinned
+        if not isinstance(data, dict) or not any(k in data for k in _CF_LIST_KEYS):
+            return None
+        items = data.get("customFields") or data.get("items") or data.get("list") or []
+        if not isinstance(items, list):
+            return None
+        etag = r.headers.get("ETag")
+        if etag:
+            _CF_ETAG[etag_key] = (etag, items)
+        return items
+
+    known = _WORKING_CF_URL.get(cache_key)
+    if known:
         try:
-            r = requests.get(u, headers=_headers(token, location_id), timeout=30)
-            if not r.ok:
-                continue
+            items = _probe(known)
+            if items is not None:
+                return items
+        except requests.RequestException as e:
+            if _is_auth_error(e):
+                # Token rejected: every variant would say the same
+                return []
+        # Known-good URL stopped answering; fall back to probing every variant
+
+    # Probe the URL variants concurrently and take the first that answers with a list, so a
+    # slow or dead variant costs one round trip of wall time instead of one each
+    ex = ThreadPoolExecutor(max_workers=len(urls))
+    try:
+        futures = {ex.submit(_probe, u): u for u in urls}
+        for fut in as_completed(futures):
             try:
-                data = r.json()
-            except Exception:
+                items = fut.result()
+            except requests.RequestException:
                 continue
-            items = data.get("customFields") or data.get("items") or data.get("list") or []
-            if isinstance(items, list):
+            if items is not None:
+                for other in futures:
+                    other.cancel()
+                _WORKING_CF_URL[cache_key] = futures[fut]
                 return items
-        except Exception:
-            continue
+    finally:
+        # Don't wait on the losing probes
+        ex.shutdown(wait=False)
     return []
 
 
+# Field IDs don't change within a process: (lowercased name, location, token hash) -> id.
+# Misses are not stored, so a field created later is still found.
+_CF_ID_CACHE: Dict[Tuple[str, str, str], str] = {}
+_CF_ID_LOCK = threading.Lock()
+
+
+def _cf_cache_key(name: str, token: str, location_id: Optional[str]) -> Tuple[str, str, str]:
+    # Short token hash keeps different tokens apart without holding the token in the key
+    tok = hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+    return (name.strip().lower(), location_id or "", tok)
+
+
+def _refresh_cf_ids(token: str, location_id: Optional[str]) -> Dict[str, str]:
+    """List custom fields once and cache every lowercased name -> id (first match wins)."""
+    by_name: Dict[str, str] = {}
+    for it in _list_custom_fields(token, location_id):
+        fid = it.get("id")
+        if fid:
+            by_name.setdefault(str(it.get("name", "")).strip().lower(), fid)
+    _, loc, tok = _cf_cache_key("", token, location_id)
+    with _CF_ID_LOCK:
+        # One listing answers every name, so remember all of them
+        _CF_ID_CACHE.update({(n, loc, tok): fid for n, fid in by_name.items()})
+    return by_name
+
+
 def find_custom_field_id_by_name(name: str) -> Optional[str]:
-    token = _env("HIGHLEVEL_ACCESS_TOKEN") or _env("HIGHLEVEL_TOKEN") or _env("GHL_TOKEN")
-    location_id = _env("HIGHLEVEL_LOCATION_ID") or _env("GHL_LOCATION_ID")
+    token = _get_token()
+    location_id = _get_location_id()
     if not token:
         return None
-    name_lower = name.strip().lower()
-    items = _list_custom_fields(token, location_id)
-    for it in items:
-        it_name = str(it.get("name", "")).strip().lower()
-        if it_name == name_lower:
-            return it.get("id")
-    return None
+    key = _cf_cache_key(name, token, location_id)
+    with _CF_ID_LOCK:
+        cached = _CF_ID_CACHE.get(key)
+    if cached:
+        return cached
+    return _refresh_cf_ids(token, location_id).get(key[0])
 
 
 def create_text_custom_field(name: str) -> Optional[str]:
-    token = _env("HIGHLEVEL_ACCESS_TOKEN") or _env("HIGHLEVEL_TOKEN") or _env("GHL_TOKEN")
-    location_id = _env("HIGHLEVEL_LOCATION_ID") or _env("GHL_LOCATION_ID")
+    token = _get_token()
+    location_id = _get_location_id()
     if not token:
         return None
     payloads = [
@@ -215,17 +504,17 @@ def create_text_custom_field(name: str) -> Optional[str]:
     for u in urls:
         for p in payloads:
             try:
-                r = requests.post(u, headers=_headers(token, location_id), json=p, timeout=30)
-                if r.ok:
-                    try:
-                        d = r.json()
-                    except Exception:
-                        d = {}
-                    fid = d.get("id") or d.get("customFieldId") or (d.get("customField") or {}).get("id")
-                    if fid:
-                        return fid
-            except Exception:
+                d = _json_body(_SESSION.post(u, headers=_headers(token, location_id), data=_json_dumps(p), timeout=30))
+            except requests.RequestException as e:
+                if _is_auth_error(e):
+                    # Token rejected: no variant or payload will succeed
+                    return None
+                continue
+            if not isinstance(d, dict):
                 continue
+            fid = d.get("id") or d.get("customFieldId") or _sub_dict(d, "customField").get("id")
+            if fid:
+                return fid
     return None
 
 
@@ -233,7 +522,44 @@ def get_or_create_custom_field_id(field_name: str) -> Optional[str]:
     fid = find_custom_field_id_by_name(field_name)
     if fid:
         return fid
-    return create_text_custom_field(field_name)
+    fid = create_text_custom_field(field_name)
+    if fid:
+        token = _get_token()
+        location_id = _get_location_id()
+        with _CF_ID_LOCK:
+            _CF_ID_CACHE[_cf_cache_key(field_name, token, location_id)] = fid
+    return fid
+
+
+def get_or_create_many(names: List[str]) -> Dict[str, Optional[str]]:
+    """Resolve several custom fields by name, creating the missing ones concurrently.
+
+    Cached names cost nothing; the rest are answered by a single field listing, and only
+    names still missing after it are created, in parallel. Returns {name: id or None}.
+    """
+    names = list(dict.fromkeys(names))
+    token = _get_token()
+    location_id = _get_location_id()
+    if not token or not names:
+        return {n: None for n in names}
+    keys = {n: _cf_cache_key(n, token, location_id) for n in names}
+    with _CF_ID_LOCK:
+        results: Dict[str, Optional[str]] = {n: _CF_ID_CACHE.get(k) for n, k in keys.items()}
+    if not all(results.values()):
+        by_name = _refresh_cf_ids(token, location_id)
+        for n, fid in results.items():
+            if not fid:
+                results[n] = by_name.get(keys[n][0])
+    missing = [n for n, fid in results.items() if not fid]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+            created = dict(zip(missing, ex.map(create_text_custom_field, missing)))
+        with _CF_ID_LOCK:
+            for n, fid in created.items():
+                if fid:
+                    _CF_ID_CACHE[keys[n]] = fid
+        results.update(created)
+    return results
 
 
 def upsert_contact_with_fields(
@@ -249,8 +575,8 @@ def upsert_contact_with_fields(
 
     custom_fields_by_symbol keys should be one of keys from _resolve_field_ids().
     """
-    token = _env("HIGHLEVEL_ACCESS_TOKEN") or _env("HIGHLEVEL_TOKEN") or _env("GHL_TOKEN")
-    location_id = _env("HIGHLEVEL_LOCATION_ID") or _env("GHL_LOCATION_ID")
+    token = _get_token()
+    location_id = _get_location_id()
     if not token or not location_id:
         return {"skipped": True, "reason": "Missing token/location"}
 
@@ -259,6 +585,35 @@ def upsert_contact_with_fields(
     cached = _load_cached_contact(session_key)
     final_email = email or (cached.get("email") if cached else None) or f"{session_key}@example.com"
 
+    data = _upsert_contact(
+        token,
+        location_id,
+        email=final_email,
+        first_name=first_name,
+        last_name=last_name,
+        phone=phone,
+        tags=tags,
+        custom_fields_by_symbol=custom_fields_by_symbol,
+    )
+    # Cache contact id/email for this session
+    contact_id = _sub_dict(data, "contact").get("id") or data.get("id")
+    if contact_id:
+        _save_cached_contact(session_key, {"id": contact_id, "email": final_email})
+    return data
+
+
+def _upsert_contact(
+    token: str,
+    location_id: str,
+    *,
+    email: str,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+    phone: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    custom_fields_by_symbol: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """POST one contact upsert; never reads or writes the session contact cache."""
     field_ids = _resolve_field_ids()
     custom_fields_payload: List[Dict[str, Any]] = []
     for sym, value in (custom_fields_by_symbol or {}).items():
@@ -267,7 +622,7 @@ def upsert_contact_with_fields(
             custom_fields_payload.append({"id": fid, "value": value})
 
     payload: Dict[str, Any] = {
-        "email": final_email,
+        "email": email,
         "locationId": location_id,
         "tags": tags or [],
         "source": "AAAS Tools",
@@ -283,42 +638,46 @@ def upsert_contact_with_fields(
 
     try:
         url = f"{API_BASE}/contacts/upsert"
-        resp = requests.post(url, headers=_headers(token, location_id), json=payload, timeout=30)
-        resp.raise_for_status()
-        try:
-            data = resp.json()
-            # Cache contact id/email for this session
-            contact_id = (data.get("contact") or {}).get("id") or data.get("id")
-            if contact_id:
-                _save_cached_contact(session_key, {"id": contact_id, "email": final_email})
-            return data
-        except Exception:
-            return {"raw": resp.text}
-    except Exception as e:
+        resp = _SESSION.post(url, headers=_headers(token, location_id), data=_json_dumps(payload), timeout=30)
+        data = _json_body(resp)
+    except requests.RequestException as e:
         return {"error": str(e)}
+    if not isinstance(data, dict):
+        return {"raw": resp.text}
+    return data
 
 
 # ---------------- Session-scoped Contact Cache ----------------
+# Env var names for the agency headers, in priority order; normalized and de-duplicated once
+_SESSION_KEY_ENV_VARS = tuple(dict.fromkeys(
+    h.replace('-', '_').upper()
+    for h in (
+        "X-Chat-Id", "X-User-Id", "X-Agent-Id",
+        "X-Chat-ID", "X-ChatId", "X-User-ID", "X-UserId",
+        "CURSOR_SESSION_ID", "CURSOR_CHAT_ID", "CURSOR_TRACE_ID",
+        "AGENCY_SESSION_ID", "AGENCY_CHAT_ID", "AGENCY_USER_ID",
+    )
+))
+
+
 def _derive_session_key() -> str:
     """Derive a stable short key from agency headers to isolate users.
 
     Prioritizes X-Chat-Id, then X-User-Id, then X-Agent-Id, falling back to CURSOR_* and a random UUID.
+    Not memoized: the headers are re-read per call so each chat keeps its own key.
     """
-    candidates = [
-        "X-Chat-Id", "X-User-Id", "X-Agent-Id",
-        "X-Chat-ID", "X-ChatId", "X-User-ID", "X-UserId",
-        "CURSOR_SESSION_ID", "CURSOR_CHAT_ID", "CURSOR_TRACE_ID",
-        "AGENCY_SESSION_ID", "AGENCY_CHAT_ID", "AGENCY_USER_ID",
-    ]
-    for h in candidates:
-        v = _env(h.replace('-', '_').upper())
-        if v:
-            return str(v)[:8]
-    import uuid
+    _ensure_env()
+    environ = os.environ
+    for k in _SESSION_KEY_ENV_VARS:
+        v = environ.get(k)
+        if v and v.strip():
+            return v[:8]
     return str(uuid.uuid4())[:8]
 
 
+@cache
 def _cache_dir() -> str:
+    # Created once per process rather than on every cache read/write
     root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     path = os.path.join(root, "cache", "highlevel_contacts")
     os.makedirs(path, exist_ok=True)
@@ -329,22 +688,43 @@ def _cache_file(session_key: str) -> str:
     return os.path.join(_cache_dir(), f"{session_key}.json")
 
 
+# In-process copy of the contact cache files: disk is read once per session key (misses are
+# re-read so a contact saved later is picked up) and only written when the contact changes
+_CONTACT_MEM: Dict[str, Dict[str, Any]] = {}
+_CONTACT_LOCK = threading.Lock()
+
+
 def _load_cached_contact(session_key: str) -> Dict[str, Any]:
+    with _CONTACT_LOCK:
+        hit = _CONTACT_MEM.get(session_key)
+    if hit:
+        return hit
     try:
         p = _cache_file(session_key)
         if os.path.exists(p):
-            with open(p, 'r') as f:
-                return json.load(f)
+            with open(p, 'rb') as f:
+                data = _json_loads(f.read())
+            if isinstance(data, dict) and data:
+                with _CONTACT_LOCK:
+                    _CONTACT_MEM[session_key] = data
+            return data
     except Exception:
         pass
     return {}
 
 
 def _save_cached_contact(session_key: str, payload: Dict[str, Any]) -> None:
+    with _CONTACT_LOCK:
+        if _CONTACT_MEM.get(session_key) == payload:
+            return
+        _CONTACT_MEM[session_key] = dict(payload)
     try:
         p = _cache_file(session_key)
-        with open(p, 'w') as f:
-            json.dump(payload, f)
+        # Write to a temp file and swap it in so a crash never leaves a truncated cache file
+        tmp = f"{p}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_json_dumps(payload))
+        os.replace(tmp, p)
     except Exception:
         pass
 
@@ -362,11 +742,11 @@ def ensure_contact(
     """Ensure there is a single session-scoped contact and return its id and details.
 
     - Uses cached contact if available
-    - Upserts with provided fields
-    - Returns { ok, contact_id, email, raw }
+    - Upserts with provided fields, unless the cached contact was last upserted with the same ones
+    - Returns { ok, contact_id, email, raw } ({ ok, contact_id, email, cached } when skipped)
     """
-    token = _env("HIGHLEVEL_ACCESS_TOKEN") or _env("HIGHLEVEL_TOKEN") or _env("GHL_TOKEN")
-    location_id = _env("HIGHLEVEL_LOCATION_ID") or _env("GHL_LOCATION_ID")
+    token = _get_token()
+    location_id = _get_location_id()
     if not token or not location_id:
         return {"ok": False, "error": "Missing token/location"}
 
@@ -374,6 +754,20 @@ def ensure_contact(
     cached = _load_cached_contact(session_key)
     final_email = email or (cached.get("email") if cached else None) or f"{session_key}@example.com"
 
+    # Fingerprint of everything the upsert would send, including the field IDs the symbols map to
+    field_ids = _resolve_field_ids()
+    payload_hash = hashlib.sha1(json.dumps({
+        "location": location_id,
+        "email": final_email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "phone": phone,
+        "tags": tags or [],
+        "fields": {sym: [field_ids.get(sym), v] for sym, v in (custom_fields_by_symbol or {}).items()},
+    }, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    if cached.get("id") and cached.get("payload_hash") == payload_hash:
+        return {"ok": True, "contact_id": cached["id"], "email": final_email, "cached": True}
+
     result = upsert_contact_with_fields(
         email=final_email,
         first_name=first_name,
@@ -382,9 +776,65 @@ def ensure_contact(
         tags=tags,
         custom_fields_by_symbol=custom_fields_by_symbol,
     )
-    contact_id = (result.get("contact") or {}).get("id") or result.get("id")
+    contact_id = _sub_dict(result, "contact").get("id") or result.get("id")
     if contact_id:
-        _save_cached_contact(session_key, {"id": contact_id, "email": final_email})
+        _save_cached_contact(session_key, {"id": contact_id, "email": final_email, "payload_hash": payload_hash})
         return {"ok": True, "contact_id": contact_id, "email": final_email, "raw": result}
     return {"ok": False, "error": "No contact id in response", "raw": result}
 
+
+# ---------------- Async wrappers ----------------
+# Each runs the sync helper on a worker thread, so independent steps (field lookups, media
+# upload, upsert) can be awaited together with asyncio.gather while sharing the pooled
+# session, its retries and the process caches above.
+async def afind_custom_field_id_by_name(name: str) -> Optional[str]:
+    return await asyncio.to_thread(find_custom_field_id_by_name, name)
+
+
+async def aupload_media(
+    file_path: str, filename: Optional[str] = None, content_type: Optional[str] = None
+) -> Dict[str, Any]:
+    return await asyncio.to_thread(upload_media, file_path, filename, content_type)
+
+
+async def aupsert_contact_with_fields(
+    *,
+    email: Optional[str] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+    phone: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    custom_fields_by_symbol: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    return await asyncio.to_thread(
+        upsert_contact_with_fields,
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        phone=phone,
+        tags=tags,
+        custom_fields_by_symbol=custom_fields_by_symbol,
+    )
+
+
+async def upsert_many_contacts(records: List[Dict[str, Any]], max_concurrency: int = 10) -> List[Dict[str, Any]]:
+    """Upsert several contacts concurrently, at most max_concurrency in flight.
+
+    Each record holds upsert_contact_with_fields keyword arguments and must carry its own email:
+    batch upserts bypass the session contact cache entirely, so they neither borrow the
+    session's email nor rebind the session to one of the batch's contacts. Results keep the
+    records' order.
+    """
+    token = _get_token()
+    location_id = _get_location_id()
+    if not token or not location_id:
+        return [{"skipped": True, "reason": "Missing token/location"} for _ in records]
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _one(record: Dict[str, Any]) -> Dict[str, Any]:
+        if not record.get("email"):
+            return {"error": "email is required for batch upserts"}
+        async with sem:
+            return await asyncio.to_thread(_upsert_contact, token, location_id, **record)
+
+    return await asyncio.gather(*(_one(r) for r in records))
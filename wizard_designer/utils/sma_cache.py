@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import threading
+import hashlib
+from functools import cache
+from typing import Any, Optional
+
+# Optional dependencies
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+
+@cache
+def _cache_dir() -> str:
+    # Created once per process rather than on every get/put
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    path = os.getenv("SMA_CACHE_DIR") or os.path.join(root, "cache", "apify_results")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _dumps(value: Any) -> bytes:
+    """Canonical compact JSON (sorted keys), via orjson when installed."""
+    if orjson:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def make_key(session_id: str, actor_name: str, run_input: Any) -> str:
+    """Stable cache key for one actor run: session, actor and canonicalized input."""
+    return hashlib.sha256(f"{session_id}|{actor_name}|".encode("utf-8") + _dumps(run_input)).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(_cache_dir(), f"{key}.json")
+
+
+def get(key: str, max_age_s: float) -> Optional[Any]:
+    """Return the cached value if its file is younger than max_age_s, else None.
+
+    Freshness is revalidated from the file's mtime, so no metadata needs to be parsed
+    before deciding to skip a stale entry.
+    """
+    try:
+        p = _entry_path(key)
+        if time.time() - os.path.getmtime(p) > max_age_s:
+            return None
+        with open(p, "rb") as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson else json.loads(raw)
+    except Exception:
+        return None
+
+
+def put(key: str, value: Any) -> None:
+    try:
+        p = _entry_path(key)
+        # Write to a temp file and swap it in, so a concurrent get() or a crash mid-write
+        # never sees a truncated entry
+        tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_dumps(value))
+        os.replace(tmp, p)
+    except Exception:
+        pass